@@ -0,0 +1,148 @@
+""" Distance statistics of a puzzle's state graph: eccentricities, diameter
+(God's number in the quarter turn metric, an inverse face turn counting as one
+move), distance histograms and average distances. The explored graph is stored
+as CSR adjacency and searched by bit-parallel BFS: every vertex holds a uint64
+whose bit i marks it as reached from the i-th of 64 sources, so one level of
+the search advances 64 breadth-first searches at once with a gather and an
+OR-reduction over the adjacency. Statistics over all N sources cost about N/64
+such passes. """
+import argparse
+import numpy as np
+import enumerator as e
+from metrics import NULL_METRICS
+
+BATCH = 64
+
+
+def csr_from_edges(n, edges):
+    """ Undirected CSR adjacency of n vertices from (source, target) pairs as
+    returned by explore, duplicates and self loops are dropped.
+    :return: indptr, indices """
+    edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    edges = np.unique(np.concatenate([edges, edges[:, ::-1]]), axis=0)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 0], minlength=n), out=indptr[1:])
+    return indptr, edges[:, 1].copy()
+
+
+def state_graph(initcube, blockers, metrics=NULL_METRICS):
+    """ Explore the puzzle and return its state graph as CSR adjacency.
+    Vertex 0 is initcube.
+    :return: indptr, indices, int2cube """
+    verts, edges, _, int2cube, _ = e.explore(initcube, blockers, metrics=metrics)
+    indptr, indices = csr_from_edges(len(verts), edges)
+    return indptr, indices, int2cube
+
+
+def bit_counts(masks):
+    """ Number of masks with each of the 64 bits set. """
+    bits = np.unpackbits(masks.astype("<u8").view(np.uint8), bitorder="little")
+    return bits.reshape(-1, BATCH).sum(axis=0, dtype=np.int64)
+
+
+def bfs64(indptr, indices, sources, metrics=NULL_METRICS):
+    """ Breadth-first search from up to 64 sources at once.
+    :return: level counts as array of shape (levels, len(sources)), row d
+             holding the number of vertices at distance d from each source """
+    n = len(indptr) - 1
+    isolated = indptr[:-1] == indptr[1:]
+    starts = np.minimum(indptr[:-1], len(indices))
+    frontier = np.zeros(n, dtype=np.uint64)
+    for i, source in enumerate(sources):
+        frontier[source] |= np.uint64(1) << np.uint64(i)
+    visited = frontier.copy()
+    levels = [bit_counts(frontier[frontier != 0])]
+    while True:
+        gathered = np.append(frontier[indices], np.uint64(0))
+        reached = np.bitwise_or.reduceat(gathered, starts)
+        reached[isolated] = 0
+        frontier = reached & ~visited
+        active = frontier[frontier != 0]
+        if not len(active):
+            break
+        visited |= frontier
+        levels.append(bit_counts(active))
+        metrics.count("bfs_levels")
+        metrics.gauge("frontier", len(active))
+    return np.array(levels)[:, :len(sources)]
+
+
+def distance_stats(indptr, indices, sources=None, metrics=NULL_METRICS):
+    """
+    Distance statistics from given sources, from all vertices by default.
+    With all vertices as sources the diameter and radius are exact, with a
+    sample of them they are lower and upper bounds respectively.
+    :param sources: vertex ids, see sample_sources
+    :return: dict with eccentricities of the sources, histogram of distances
+             over all (source, vertex) pairs, diameter, radius, average
+             distance, and histogram and average of distances from vertex 0 if
+             it is among the sources
+    """
+    n = len(indptr) - 1
+    sources = np.arange(n) if sources is None else np.unique(sources)
+    ecc = np.empty(len(sources), dtype=np.int64)
+    hist = np.zeros(1, dtype=np.int64)
+    solved = None
+    for start in range(0, len(sources), BATCH):
+        batch = sources[start:start + BATCH]
+        levels = bfs64(indptr, indices, batch, metrics)
+        ecc[start:start + len(batch)] = [np.flatnonzero(col).max()
+                                         for col in levels.T]
+        counts = levels.sum(axis=1)
+        hist = np.pad(hist, (0, max(0, len(counts) - len(hist))))
+        hist[:len(counts)] += counts
+        if batch[0] == 0:
+            solved = levels[:, 0]
+            solved = solved[:np.flatnonzero(solved).max() + 1]
+        metrics.count("sources", len(batch))
+    pairs = hist.sum() - hist[0]
+    dist = np.arange(len(hist))
+    res = {"sources": sources, "eccentricities": ecc, "histogram": hist,
+           "diameter": int(ecc.max()), "radius": int(ecc.min()),
+           "average": float((dist * hist).sum() / pairs) if pairs else 0.0,
+           "exact": len(sources) == n}
+    if solved is not None:
+        res["solved_histogram"] = solved
+        res["solved_average"] = float(
+            (np.arange(len(solved)) * solved).sum() / max(1, n - 1))
+    return res
+
+
+def sample_sources(n, k, seed=0):
+    """ Vertex 0 and k-1 other vertices drawn uniformly without replacement. """
+    if k >= n:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    return np.concatenate([[0], 1 + rng.choice(n - 1, k - 1, replace=False)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split(".")[0])
+    parser.add_argument("cube", type=int,
+                        help="initial bandage state as bitarray integer")
+    parser.add_argument("--sample", type=int, metavar="K",
+                        help="use K sampled sources instead of all vertices")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of source sampling")
+    args = parser.parse_args(argv)
+
+    indptr, indices, _ = state_graph(np.uint64(args.cube), e.TURNABLE)
+    n = len(indptr) - 1
+    sources = sample_sources(n, args.sample, args.seed) if args.sample else None
+    stats = distance_stats(indptr, indices, sources)
+    bound = "" if stats["exact"] else " (bounds from %d sources)" % len(
+        stats["sources"])
+    print("States:", n)
+    print("Diameter: %d, radius: %d%s" % (stats["diameter"], stats["radius"],
+                                          bound))
+    print("Average distance: %.4f" % stats["average"])
+    print("Distance histogram:", stats["histogram"].tolist())
+    eccs, counts = np.unique(stats["eccentricities"], return_counts=True)
+    print("Eccentricities:", dict(zip(eccs.tolist(), counts.tolist())))
+    print("Average distance from initial state: %.4f" % stats["solved_average"])
+    print("Distances from initial state:", stats["solved_histogram"].tolist())
+
+
+if __name__ == "__main__":
+    main()
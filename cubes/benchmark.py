@@ -0,0 +1,240 @@
+""" Reproducible benchmarks of the bit-level kernels and exploration engines.
+Reports states per second and peak memory of each case, stores results as
+JSON baseline and flags regressions against a stored baseline. """
+import argparse
+import functools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import enumerator as e
+import analytics
+
+# reference shapes, bicube_fuse as in C++ main, the other as in enumerator.main
+SHAPES = {
+    "bicube_fuse": np.uint64(1153354739914719560),
+    "main": e.into_bitarray([   7, 7, 0,
+                               7, 7, 0,
+                              0, 0, 0,
+                                1, 1, 6,
+                               1, 1, 5,
+                              2, 3, 4,
+                               1, 1, 6,
+                              1, 1, 5,
+                             2, 3, 4], e.MAPPING),
+}
+
+# starting shapes of truncated splitting trees
+TREES = {
+    "layer_33s": [  1, 2, 3,
+                   4, 5, 6,
+                  7, 8, 9,
+                    10, 10, 10,
+                   10, 10, 10,
+                  10, 10, 10,
+                    11, 11, 11,
+                   11, 11, 11,
+                  11, 11, 11],
+    "layer_3s": [  1, 2, 3,
+                  4, 5, 6,
+                 7, 8, 9,
+                   10, 11, 12,
+                  10, 11, 12,
+                 10, 11, 12,
+                   13, 14, 15,
+                  13, 14, 15,
+                 13, 14, 15],
+}
+
+TURNS = ["U", "F", "R", "D", "B", "L", "x", "y", "z", "mir"]
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_REPEAT = 5
+# seconds each timed measurement lasts at least, calls are looped until then
+DEFAULT_MIN_TIME = 0.2
+
+
+@functools.lru_cache()
+def sample_states():
+    """ Fixed set of states: all states of the reference shapes. """
+    states = set()
+    for shape in SHAPES.values():
+        states.update(e.explore_fast(shape, e.TURNABLE, set()))
+    return sorted(states)
+
+
+@functools.lru_cache()
+def sample_cubelists():
+    return [e.from_bitarray(cube, e.MAPPING, pprint=False)
+            for cube in sample_states()]
+
+
+def bench_turn(face, states):
+    for cube in states:
+        e.turn(face, cube)
+    return len(states)
+
+
+def bench_into_bitarray(cubelists):
+    for cubelist in cubelists:
+        e.into_bitarray(cubelist, e.MAPPING)
+    return len(cubelists)
+
+
+def bench_into_bitarray_fast(cubelists):
+    for cubelist in cubelists:
+        e.into_bitarray_fast(cubelist)
+    return len(cubelists)
+
+
+def bench_from_bitarray(states):
+    for cube in states:
+        e.from_bitarray(cube, e.MAPPING, pprint=False)
+    return len(states)
+
+
+def bench_split(clist):
+    res = set()
+    maxid = max(clist)
+    blocks_to_split = sorted([(clist.count(i), i) for i in range(1, maxid + 1)])
+    e.split(np.array(clist, dtype=np.uint8), res, blocks_to_split, maxid)
+    return len(res)
+
+
+def bench_explore(shape, **kwargs):
+    return len(e.explore(shape, e.TURNABLE, **kwargs)[0])
+
+
+def bench_explore_fast(shape):
+    return len(e.explore_fast(shape, e.TURNABLE, set()))
+
+
+def bench_distances(graph):
+    analytics.distance_stats(*graph)
+    return len(graph[0]) - 1
+
+
+def cases():
+    """ Benchmark cases as name -> function preparing inputs of the case and
+    returning the timed function, which returns number of states. Inputs are
+    prepared only for cases selected to run. """
+    res = {}
+    for face in TURNS:
+        res["turn_" + face] = lambda face=face: functools.partial(
+            bench_turn, face, sample_states())
+    res["into_bitarray"] = lambda: functools.partial(
+        bench_into_bitarray, sample_cubelists())
+    res["into_bitarray_fast"] = lambda: functools.partial(
+        bench_into_bitarray_fast, sample_cubelists())
+    res["from_bitarray"] = lambda: functools.partial(
+        bench_from_bitarray, sample_states())
+    for name, clist in TREES.items():
+        res["split_" + name] = lambda clist=clist: functools.partial(
+            bench_split, clist)
+    for name, shape in SHAPES.items():
+        res["explore_" + name] = lambda shape=shape: functools.partial(
+            bench_explore, shape)
+        res["explore_fast_" + name] = lambda shape=shape: functools.partial(
+            bench_explore_fast, shape)
+        res["explore_sym_" + name] = lambda shape=shape: functools.partial(
+            bench_explore, shape, reduce_symmetry=True)
+        res["distances_" + name] = lambda shape=shape: functools.partial(
+            bench_distances, analytics.state_graph(shape, e.TURNABLE)[:2])
+    return res
+
+
+def measure(func, repeat, min_time=DEFAULT_MIN_TIME):
+    """ Best states per second out of repeat measurements, each calling func
+    in a loop for at least min_time seconds, so that cases of milliseconds
+    are not dominated by timer resolution and scheduling noise. An untimed
+    warm-up call comes first, peak memory of one more call is traced
+    separately so that tracing doesn't skew the timing. """
+    states = func()
+    best = float("inf")
+    for _ in range(repeat):
+        loops, start = 0, time.perf_counter()
+        while True:
+            func()
+            loops += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / loops)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"states": states, "seconds": best,
+            "states_per_sec": states / best if best > 0 else float("inf"),
+            "peak_bytes": peak}
+
+
+def run(names=None, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    results = {}
+    for name, setup in cases().items():
+        if names and not any(n in name for n in names):
+            continue
+        results[name] = measure(setup(), repeat, min_time)
+        r = results[name]
+        print("{0:28} {1:>9} states {2:>14,.0f} states/s {3:>10,.0f} KiB peak"
+              .format(name, r["states"], r["states_per_sec"],
+                      r["peak_bytes"] / 1024))
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ List regressions: throughput dropped or peak memory grew by more than
+    tolerance relative to the baseline. """
+    regressions = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        b = baseline[name]
+        if r["states_per_sec"] < b["states_per_sec"] * (1 - tolerance):
+            regressions.append("%s: %.0f states/s, baseline %.0f" % (
+                name, r["states_per_sec"], b["states_per_sec"]))
+        if r["peak_bytes"] > b["peak_bytes"] * (1 + tolerance):
+            regressions.append("%s: %d bytes peak, baseline %d" % (
+                name, r["peak_bytes"], b["peak_bytes"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split(".")[0])
+    parser.add_argument("cases", nargs="*",
+                        help="run only cases whose name contains any of these")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="timed measurements per case, best one is "
+                             "reported")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                        metavar="SECONDS",
+                        help="least duration of each measurement, the case "
+                             "is run repeatedly until then")
+    parser.add_argument("--save", metavar="PATH",
+                        help="store results as JSON baseline")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="compare results against JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative slowdown or memory growth allowed")
+    args = parser.parse_args(argv)
+
+    results = run(args.cases, args.repeat, args.min_time)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version.split()[0],
+                       "numpy": np.__version__,
+                       "machine": platform.platform(),
+                       "results": results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for reg in regressions:
+            print("REGRESSION", reg)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+""" Checkpointing of long running passes. A pass periodically saves its state
+(result set, split stack, ...) as numpy arrays into a compressed npz file.
+The file is written next to its destination and renamed over it, so a crash
+never leaves a torn checkpoint behind. Cubes in the state
+depend on the mapping, so its hash is saved along and a checkpoint of another
+mapping is refused on load, as with shards. """
+import os
+import time
+import numpy as np
+
+# default number of due calls between checks of the clock
+CHECK_EVERY = 1024
+
+
+class Checkpoint:
+    """
+    :param path:     checkpoint file
+    :param mhash:    mapping_hash of the mapping cubes are represented in
+    :param interval: seconds between saves
+    :param resume:   whether load returns state saved by a previous run
+    """
+
+    def __init__(self, path, mhash, interval=600.0, resume=False):
+        self.path = path
+        self.mhash = mhash
+        self.interval = interval
+        self.resume = resume
+        self.last = time.monotonic()
+        self.ticks = 0
+
+    def due(self, every=CHECK_EVERY):
+        """ Cheap check whether it's time to save, call it in hot loops.
+        :param every: calls between checks of the clock, 1 for loops doing
+                      a lot of work per iteration """
+        self.ticks += 1
+        if self.ticks < every:
+            return False
+        self.ticks = 0
+        return time.monotonic() - self.last >= self.interval
+
+    def save(self, **state):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, mapping=np.uint64(self.mhash), **state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.last = time.monotonic()
+
+    def load(self):
+        """ Saved state as dict of arrays, None if there is nothing to resume. """
+        if not self.resume or not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as data:
+            state = {k: data[k] for k in data.files}
+        if "mapping" not in state or int(state.pop("mapping")) != self.mhash:
+            raise ValueError("Checkpoint %s was stored under another MAPPING, "
+                             "convert it with remap.py" % self.path)
+        return state
+
+    def clear(self):
+        """ Remove checkpoint of a finished pass. """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def pack_set(cubes):
+    return np.fromiter(cubes, dtype=np.uint64, count=len(cubes))
@@ -0,0 +1,9 @@
+""" Fixtures shared by the regression checks. """
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="session")
+def bicube_fuse():
+    """ Small puzzle with 121 states, see benchmark.SHAPES. """
+    return np.uint64(1153354739914719560)
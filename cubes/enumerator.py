@@ -1,10 +1,14 @@
 import numpy as np
 import csv
+import os
 import bisect
 from collections import deque
 import bce.core as c
 from bce.graphics import draw_cubes as draw
-from representation_finder import gencode_faceturns, gencode_rots
+from representation_finder import gencode_faceturns, gencode_rots, gencode_mirror
+from representation_finder import mapping_hash
+from metrics import NULL_METRICS
+from checkpoint import pack_set
 
 # mapping of pairs to bitarray positions found by backtracking optimizer
 MAPPING = {"uFr": 42, "ubR": 44, "uBl": 46, "ufL": 48,
@@ -51,6 +55,26 @@ CYCLES = [['uFr', 'ubR', 'uBl', 'ufL'], ['uFr', 'Ubr', 'dBr', 'Dfr'],
 PAIRS = set(p for c in CYCLES for p in c)
 assert PAIRS == MAPPING.keys()
 
+# bit mask of all bit offsets used by MAPPING
+USED_SLOTS = np.uint64(sum(2**v for v in set(MAPPING.values())))
+
+# the 24 cube rotations in the same order as C++ Turns enum
+ROTATIONS = ["", "x", "x2", "x'", "y", "y2", "y'", "x z", "x z2", "x z'",
+             "x2 y", "x2 y2", "x2 y'", "x' z", "x' z2", "x' z'", "z", "z x",
+             "z x2", "z x'", "z'", "z' x", "z' x2", "z' x'"]
+# all 48 cube rotations and reflections
+SYMMETRIES = ROTATIONS + [("mir " + rot).strip() for rot in ROTATIONS]
+
+# fingerprint of MAPPING, cubes stored under another mapping are rejected
+MAPPING_HASH = mapping_hash(MAPPING)
+
+# binary shard files: magic, format version, hash of the mapping the cubes are
+# stored in, number of cubes, then raw cubes
+SHARD_MAGIC = b"BCES"
+SHARD_VERSION = 2
+SHARD_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"),
+                         ("mapping", "<u8"), ("count", "<u8")])
+
 
 def enumerate_analytic():
     """
@@ -197,135 +221,250 @@ def do(bitarray, moves):
     return res
 
 
-def split(clist, res, blocks_to_split, cmax):
+def split_candidates(clist, blocks_to_split):
     """
-    Keep recursively splitting fully bandaged (isomorphic to 1x1) 3x3 cube by
-    planes to enumerate all interesting bandage shapes.
-    :param clist: cubelist representation of bandage shape
-    :param res: reference to set with enumerated cubelists in bitarray
-        representation
-    :param blocks_to_split: blocks allowed to be splitted - not having all
-        blocks allowed to be splitted at all times prevents rediscovering
-        same bandage shapes by many different splitting sequences. List of
-        tuples (block size, block index) sorted ascending.
-    :param cmax: maximum of clist
+    List all ways of splitting one of blocks_to_split in two, in the order in
+    which split tries them. Each is a tuple (indices of the new block, sizes of
+    the two resulting blocks, index of the split block, position of the split
+    block in blocks_to_split).
     """
-    def split_to_blocks(block1, clist, res, blocks_to_split, cmax, sizes, bn):
-        """ Try to add result to hash set and continue splitting. """
-        newclist = np.array(clist)
-        newclist[block1] = cmax + 1
-        newcl_b = into_bitarray_fast(newclist)
-        if newcl_b not in res:
-            res.add(newcl_b)
-            new_bts = list(blocks_to_split)
-            bisect.insort(new_bts, (sizes[0], cmax + 1))
-            bisect.insort(new_bts, (sizes[1], bn))
-            split(newclist, res, new_bts, cmax + 1)
-
-    if len(res) % 100000 == 0:
-        print(len(res))
+    cands = []
     for i, (blocksize, blockno) in enumerate(blocks_to_split):
         block = np.where(clist == blockno)[0]
-        new_bts = blocks_to_split[:i]
         if blocksize == 27:  # 333 starting block
             # into 33 and 332
             newb1 = block[:9]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (9, 18), blockno)
+            cands.append((newb1, (9, 18), blockno, i))
         elif blocksize == 18:  # 332 block
             # into 33s
             newb1 = block[:9]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (9, 9), blockno)
+            cands.append((newb1, (9, 9), blockno, i))
             # into 32 and 322
             newb1 = block[::3]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (6, 12), blockno)
+            cands.append((newb1, (6, 12), blockno, i))
         elif blocksize == 12:  # 322 block
             # into 32s
             newb1 = block[::2]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (6, 6), blockno)
+            cands.append((newb1, (6, 6), blockno, i))
             newb1 = block[:6]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (6, 6), blockno)
+            cands.append((newb1, (6, 6), blockno, i))
             # into 22 and 222
             newb1 = block[[4, 5, 10, 11]]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (4, 8), blockno)
+            cands.append((newb1, (4, 8), blockno, i))
             newb1 = block[[0, 1, 6, 7]]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (4, 8), blockno)
+            cands.append((newb1, (4, 8), blockno, i))
         elif blocksize == 9:  # 33 block
             # into 3 and 32
             newb1 = block[::3]  # aligned with the 332 vertical cut
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (3, 6), blockno)
+            cands.append((newb1, (3, 6), blockno, i))
         elif blocksize == 8:  # 222 block
             # into 22s
             newb1 = block[:4]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (4, 4), blockno)
+            cands.append((newb1, (4, 4), blockno, i))
             newb1 = block[::2]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (4, 4), blockno)
+            cands.append((newb1, (4, 4), blockno, i))
             newb1 = block[[0, 1, 4, 5]]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (4, 4), blockno)
+            cands.append((newb1, (4, 4), blockno, i))
         elif blocksize == 6:  # 32 block
             if (block[0] + 2 == block[1] + 1 == block[2] or  # orientation 1
                     block[0] + 6 == block[1] + 3 == block[2]):  # orientation 2
                 # into 2 and 22
                 newb1 = block[[0, 3]]
-                split_to_blocks(newb1, clist, res, new_bts, cmax, (2, 4), blockno)
+                cands.append((newb1, (2, 4), blockno, i))
                 newb1 = block[[2, 5]]
-                split_to_blocks(newb1, clist, res, new_bts, cmax, (2, 4), blockno)
+                cands.append((newb1, (2, 4), blockno, i))
                 # into 3s
                 newb1 = block[:3]
-                split_to_blocks(newb1, clist, res, new_bts, cmax, (3, 3), blockno)
+                cands.append((newb1, (3, 3), blockno, i))
             elif block[1] + 2 == block[2]:  # orientation 3
                 # into 2 and 22
                 newb1 = block[:2]
-                split_to_blocks(newb1, clist, res, new_bts, cmax, (2, 4), blockno)
+                cands.append((newb1, (2, 4), blockno, i))
                 newb1 = block[:4]
-                split_to_blocks(newb1, clist, res, new_bts, cmax, (4, 2), blockno)
+                cands.append((newb1, (4, 2), blockno, i))
                 # into 3s
                 newb1 = block[::2]
-                split_to_blocks(newb1, clist, res, new_bts, cmax, (3, 3), blockno)
+                cands.append((newb1, (3, 3), blockno, i))
             else:
                 raise Exception("Unexpected 32 block orientation!")
         elif blocksize == 4:  # 22 block
             # into 2s
             newb1 = block[:2]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (2, 2), blockno)
+            cands.append((newb1, (2, 2), blockno, i))
             newb1 = block[::2]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (2, 2), blockno)
+            cands.append((newb1, (2, 2), blockno, i))
         elif blocksize == 3:  # 3 block
             # into 1 and 2
             newb1 = block[:2]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (2, 1), blockno)
+            cands.append((newb1, (2, 1), blockno, i))
             newb1 = block[1:]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (2, 1), blockno)
+            cands.append((newb1, (2, 1), blockno, i))
         elif blocksize == 2:  # 2 block
             # into 1 and 1
             newb1 = block[[0]]
-            split_to_blocks(newb1, clist, res, new_bts, cmax, (1, 1), blockno)
+            cands.append((newb1, (1, 1), blockno, i))
+    return cands
+
+
+def split(clist, res, blocks_to_split, cmax, metrics=NULL_METRICS,
+          checkpoint=None, branch=0, stack=None):
+    """
+    Keep recursively splitting fully bandaged (isomorphic to 1x1) 3x3 cube by
+    planes to enumerate all interesting bandage shapes. The recursion is kept
+    on an explicit stack so that it can be checkpointed.
+    :param clist: cubelist representation of bandage shape
+    :param res: reference to set with enumerated cubelists in bitarray
+        representation
+    :param blocks_to_split: blocks allowed to be splitted - not having all
+        blocks allowed to be splitted at all times prevents rediscovering
+        same bandage shapes by many different splitting sequences. List of
+        tuples (block size, block index) sorted ascending.
+    :param cmax: maximum of clist
+    :param metrics: metrics sink, see metrics.Metrics
+    :param checkpoint: checkpoint.Checkpoint to periodically save res and the
+        stack to, together with branch (see enumerate_by_splitting)
+    :param stack: stack to resume from, see unpack_split_stack
+    """
+    if stack is None:
+        stack = [[np.array(clist), list(blocks_to_split), cmax, None, 0]]
+    metrics.gauge("set_size", lambda: len(res))
+    while stack:
+        frame = stack[-1]
+        clist, blocks_to_split, cmax, cands, pos = frame
+        if cands is None:
+            cands = frame[3] = split_candidates(clist, blocks_to_split)
+            metrics.count("states_expanded")
+        if pos == len(cands):
+            stack.pop()
+            continue
+        frame[4] += 1
+        block1, sizes, bn, i = cands[pos]
+        # try to add result to hash set and continue splitting
+        newclist = np.array(clist)
+        newclist[block1] = cmax + 1
+        newcl_b = into_bitarray_fast(newclist)
+        if newcl_b not in res:
+            res.add(newcl_b)
+            new_bts = blocks_to_split[:i]
+            bisect.insort(new_bts, (sizes[0], cmax + 1))
+            bisect.insort(new_bts, (sizes[1], bn))
+            stack.append([newclist, new_bts, cmax + 1, None, 0])
+        else:
+            metrics.count("duplicates")
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save(res=pack_set(res), branch=branch,
+                            **pack_split_stack(stack))
+    metrics.gauge("set_size", len(res))
+
+
+def pack_split_stack(stack):
+    """ Split stack as flat arrays for checkpointing. """
+    bts = [b for frame in stack for b in frame[1]]
+    return {"clists": np.array([frame[0] for frame in stack], dtype=np.uint8),
+            "cmaxs": np.array([frame[2] for frame in stack], dtype=np.int64),
+            "positions": np.array([frame[4] for frame in stack], dtype=np.int64),
+            "bts": np.array(bts, dtype=np.int64).reshape(-1, 2),
+            "bts_counts": np.array([len(frame[1]) for frame in stack],
+                                   dtype=np.int64)}
+
+
+def unpack_split_stack(state):
+    """ Inverse of pack_split_stack, candidates are recomputed lazily. """
+    stack, offset = [], 0
+    for clist, cmax, pos, cnt in zip(state["clists"], state["cmaxs"],
+                                     state["positions"], state["bts_counts"]):
+        bts = [tuple(b) for b in state["bts"][offset:offset + cnt].tolist()]
+        offset += cnt
+        stack.append([np.array(clist), bts, int(cmax), None, int(pos)])
+    return stack
 
 
 # generated code for face turns and cube rotations - magic bitwise constants
 exec(gencode_faceturns(CYCLES, MAPPING))
 exec(gencode_rots(MAPPING))
+exec(gencode_mirror(MAPPING))
 
 
 def turn(face, cube):
     dsp = {"U": turn_u, "F": turn_f, "R": turn_r, "D": turn_d, "B": turn_b,
            "L": turn_l, "x": turn_x, "y": turn_y, "z": turn_z, "x'": turn_xi,
            "y'": turn_yi, "z'": turn_zi, "x2": turn_x2, "y2": turn_y2,
-           "z2": turn_z2}
+           "z2": turn_z2, "mir": turn_mir}
     return dsp[face](cube)
 
 
-def explore(initcube, blockers):
-    """ Breadth-first explore given puzzle from given bandage state. """
+def symmetry_perm(sym):
+    """ Permutation of bit offsets done by a symmetry given as move string. """
+    perm = [int(do(np.uint64(2**i), sym)).bit_length() - 1 for i in range(64)]
+    return tuple(i if p < 0 else p for i, p in enumerate(perm))  # unused bits
+
+
+def symmetry_tables(perms):
+    """ Byte lookup tables applying many bit permutations at once:
+    tables[j, b] holds images of byte value b at byte offset j under all of
+    them. """
+    bitimgs = np.left_shift(np.uint64(1), np.array(perms, dtype=np.uint64))
+    bits = (np.arange(256)[:, None] >> np.arange(8)) & 1
+    tables = np.zeros((8, 256, len(perms)), dtype=np.uint64)
+    for j in range(8):
+        sel = np.where(bits[:, :, None] == 1, bitimgs[:, 8*j:8*j + 8].T[None],
+                       np.uint64(0))
+        tables[j] = np.bitwise_or.reduce(sel, axis=1)
+    return tables
+
+
+SYM_PERMS = [symmetry_perm(sym) for sym in SYMMETRIES]
+SYM_TABLES = symmetry_tables(SYM_PERMS)
+# representatives expanded at once by explore_quotient
+QUOTIENT_BLOCK = 1024
+
+
+def symmetry_images(cube):
+    """ Images of cube under all SYMMETRIES, in the same order. Images of an
+    array of cubes are given along a new last axis. """
+    cbytes = np.asarray(cube, dtype='<u8')[..., None].view(np.uint8)
+    return np.bitwise_or.reduce(SYM_TABLES[np.arange(8), cbytes], axis=-2)
+
+
+def close_group(syms):
+    """ Close given symmetries (indices into SYMMETRIES) under composition. """
+    index = {p: i for i, p in enumerate(SYM_PERMS)}
+    group = set(syms)
+    new = set(group)
+    while new:
+        prods = set()
+        for a in new:
+            for b in group:
+                pa, pb = SYM_PERMS[a], SYM_PERMS[b]
+                prods.add(index[tuple(pb[pa[i]] for i in range(64))])
+                prods.add(index[tuple(pa[pb[i]] for i in range(64))])
+        new = prods - group
+        group |= new
+    return sorted(group)
+
+
+def explore(initcube, blockers, reduce_symmetry=False, metrics=NULL_METRICS):
+    """ Breadth-first explore given puzzle from given bandage state.
+    :param reduce_symmetry: explore only one state per orbit of the puzzle's
+        symmetry group, see explore_quotient. Returned graph is then the
+        quotient graph with vertices being orbit representatives, followed by
+        the symmetry group and the number of states of the full graph. """
+    initcube = np.bitwise_and(initcube, USED_SLOTS)  # as left by face turns
+    if reduce_symmetry:
+        return explore_quotient(initcube, blockers, metrics)
     verts, edges, tovisit = set(), [], deque([initcube])
     edgelabels = {}
     cube2int, int2cube = {}, {}
     cube2int[initcube] = 0
     int2cube[0] = initcube
     counter = 0
+    metrics.gauge("frontier", lambda: len(tovisit))
+    metrics.gauge("set_size", lambda: len(verts))
 
     while tovisit:
         cube = tovisit.popleft()
         verts.add(cube)
+        metrics.count("states_expanded")
         for face in 'UDRLFB':
             if np.bitwise_and(cube, blockers[face]) == 0:
                 new = turn(face, cube)
@@ -338,28 +477,241 @@ def explore(initcube, blockers):
                 edges.append(newedge)
                 edgelabels[newedge] = face
 
+    metrics.count("duplicates", len(edges) - counter)
+    metrics.gauge("frontier", 0)
+    metrics.gauge("set_size", len(verts))
     return verts, edges, edgelabels, int2cube, cube2int
 
 
-def explore_fast(initcube, blockers, cubes):
+def explore_quotient(initcube, blockers, metrics=NULL_METRICS):
+    """
+    Breadth-first explore given puzzle storing one state per orbit of its
+    symmetry group - the subgroup of the 48 cube rotations and reflections
+    mapping the puzzle's state graph onto itself. States are keyed by their
+    smallest image under all 48 symmetries. Whenever a turn leads to an
+    already seen orbit, symmetries mapping the orbit's representative onto the
+    new state are symmetries of the puzzle, which is how the group is found.
+    Some symmetries turn clockwise face turns into anticlockwise ones, so
+    representatives are expanded by inverse face turns too. Representatives
+    are expanded level by level in blocks turned at once, images of
+    representatives are kept for finding symmetries until all 48 are found.
+    :return: quotient graph as in explore, symmetry group of the puzzle as list
+             of move strings and number of states of the full state graph
+    """
+    initcube = np.bitwise_and(initcube, USED_SLOTS)  # as left by face turns
+    images = symmetry_images(initcube)
+    reps, rep_images = {images.min(): initcube}, {images.min(): images}
+    syms = set(np.nonzero(images == initcube)[0].tolist())
+    moves = [m for f in 'UDRLFB' for m in (f, f + "'")]
+    level = [initcube]
+    edges, edgelabels = [], {}
+    cube2int, int2cube = {initcube: 0}, {0: initcube}
+    counter = 0
+    metrics.gauge("frontier", lambda: len(level))
+    metrics.gauge("set_size", lambda: len(reps))
+
+    while level:
+        nextlevel = []
+        for start in range(0, len(level), QUOTIENT_BLOCK):
+            cubes = np.array(level[start:start + QUOTIENT_BLOCK],
+                             dtype=np.uint64)
+            metrics.count("states_expanded", len(cubes))
+            news = np.empty((len(cubes), len(moves)), dtype=np.uint64)
+            free = np.empty(news.shape, dtype=bool)
+            for i, face in enumerate('UDRLFB'):
+                news[:, 2*i] = turn(face, cubes)
+                news[:, 2*i + 1] = turn(face, turn(face, news[:, 2*i]))
+                free[:, 2*i:2*i + 2] = (np.bitwise_and(cubes, blockers[face])
+                                        == 0)[:, None]
+            rows, cols = np.nonzero(free)
+            news = news[free]
+            images = symmetry_images(news)
+            for row, col, new, newimages, newkey in zip(
+                    rows.tolist(), cols.tolist(), news, images,
+                    images.min(axis=1).tolist()):
+                if newkey not in reps:
+                    reps[newkey] = new
+                    rep_images[newkey] = newimages
+                    nextlevel.append(new)
+                    counter += 1
+                    cube2int[new] = counter
+                    int2cube[counter] = new
+                rep = reps[newkey]
+                if len(syms) < len(SYMMETRIES):
+                    syms.update(np.nonzero(rep_images[newkey] == new)[0].tolist())
+                newedge = (cube2int[cubes[row]], cube2int[rep])
+                edges.append(newedge)
+                edgelabels[newedge] = moves[col]
+        level = nextlevel
+
+    group = close_group(syms)
+    full = int(sum(len(group) // np.sum(rep_images[key][group] == rep)
+                   for key, rep in reps.items()))
+    metrics.count("duplicates", len(edges) - counter)
+    metrics.gauge("frontier", 0)
+    metrics.gauge("set_size", len(reps))
+    metrics.gauge("full_states", full)
+    metrics.gauge("symmetry_order", len(group))
+    group = [SYMMETRIES[i] for i in group]
+    return set(reps.values()), edges, edgelabels, int2cube, cube2int, group, full
+
+
+def explore_fast(initcube, blockers, cubes, metrics=NULL_METRICS):
     """ Version for use in enumeration of equivalence classes.
         :param cubes: reference to set of cubes to (try to) drop discovered
                       cubes from """
     verts, tovisit = set(), deque([initcube])
+    duplicates = 0
     while tovisit:
         cube = tovisit.popleft()
         verts.add(cube)
         cubes.discard(cube)
+        metrics.count("states_expanded")
         for face in 'UDRLFB':
             if np.bitwise_and(cube, blockers[face]) == 0:
                 new = turn(face, cube)
                 if new not in verts and new not in tovisit:
                     tovisit.append(new)
+                else:
+                    duplicates += 1
+    metrics.count("duplicates", duplicates)
     return verts
 
 
-def enumerate_by_splitting():
-    res = set()
+# slot offsets, and bit planes labelling every used slot by its offset
+OFFSETS = np.arange(64, dtype=np.uint64)
+OFFSET_PLANES = np.array(
+    [sum(2**i for i in range(64) if i >> k & 1 and int(USED_SLOTS) >> i & 1)
+     for k in range(6)], dtype=np.uint64)
+# rows of frames decoded at once
+LABEL_BLOCK = 2**14
+
+
+def offset_bits(masks):
+    """ Boolean array of bits of given masks, one row of 64 per mask. """
+    return ((masks[..., None] >> OFFSETS) & np.uint64(1)).astype(bool)
+
+
+def plane_labels(planes):
+    """ Decode rows of six bit planes into labels of all 64 slots. """
+    labels = np.zeros(planes.shape[:-1] + (64,), dtype=np.uint8)
+    for k in range(6):
+        labels |= offset_bits(planes[..., k]).astype(np.uint8) << k
+    return labels
+
+
+def in_sorted(arr, values):
+    """ Mask of values present in sorted array arr. """
+    if not len(arr):
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(arr, values).clip(max=len(arr) - 1)
+    return arr[pos] == values
+
+
+def explore_states(initcube, blockers, metrics=NULL_METRICS):
+    """ Breadth-first explore given puzzle level by level, turning the whole
+    frontier at once.
+    :return: sorted array of all states of the puzzle """
+    seen = frontier = np.array([initcube], dtype=np.uint64)
+    while len(frontier):
+        metrics.count("states_expanded", len(frontier))
+        new = np.unique(np.concatenate(
+            [turn(face, frontier[np.bitwise_and(frontier, blockers[face]) == 0])
+             for face in 'UDRLFB']))
+        frontier = new[~in_sorted(seen, new)]
+        seen = np.union1d(seen, frontier)
+    return seen
+
+
+def implicit_bonds(initcube, blockers, metrics=NULL_METRICS):
+    """
+    Breadth-first explore given puzzle level by level, carrying along labels
+    of the not yet glued pairs of initcube in frames: the state, the mask of
+    slots holding a pair not separated on the way from initcube, and the
+    offsets of their starting slots as six bit planes. Pairs on the cut of a
+    face turn are separated. Each state keeps the frame it was first reached
+    with; where a turn reaches it with another one, the pairs met in the same
+    slot share their fate, and a pair meeting a separated one is separated.
+    Pairs never separated, directly or by sharing fate with a separated one,
+    are the implicit bonds of the puzzle. They do not depend on the path
+    taken, unlike with carrying a single mask depth-first as C++ explore_dfs
+    does, which misses pairs moved around by cycles of states.
+    :return: dict of all states of the puzzle to the same states with
+             implicit bonds glued
+    """
+    init = np.bitwise_and(initcube, USED_SLOTS)
+    seen = frontier = np.concatenate(
+        [[init, np.bitwise_and(np.invert(init), USED_SLOTS)], OFFSET_PLANES])[None]
+    separated = np.zeros(64, dtype=bool)
+    related = set()
+    while len(frontier):
+        metrics.count("states_expanded", len(frontier))
+        cut = np.zeros(len(frontier), dtype=np.uint64)
+        new = []
+        for face in 'UDRLFB':
+            free = np.bitwise_and(frontier[:, 0], blockers[face]) == 0
+            cut[free] |= blockers[face]
+            turned = frontier[free]
+            turned[:, 1] &= np.invert(blockers[face])
+            new.append(turn(face, turned))
+        for i in range(0, len(frontier), LABEL_BLOCK):
+            block = slice(i, i + LABEL_BLOCK)
+            held = offset_bits(frontier[block, 1] & cut[block])
+            separated[plane_labels(frontier[block, 2:])[held]] = True
+        new = np.concatenate(new)
+        _, first = np.unique(new[:, 0], return_index=True)
+        frontier = new[first][~in_sorted(seen[:, 0], new[first, 0])]
+        seen = np.concatenate([seen, frontier])
+        seen = seen[np.argsort(seen[:, 0], kind="stable")]
+        # frames reaching states explored with another frame
+        old = seen[np.searchsorted(seen[:, 0], new[:, 0])]
+        differ = (new[:, 1:] != old[:, 1:]).any(axis=1)
+        new, old = new[differ], old[differ]
+        for i in range(0, len(new), LABEL_BLOCK):
+            block = slice(i, i + LABEL_BLOCK)
+            held, held_old = offset_bits(new[block, 1]), offset_bits(old[block, 1])
+            labels = plane_labels(new[block, 2:])
+            labels_old = plane_labels(old[block, 2:])
+            separated[labels[held & ~held_old]] = True
+            separated[labels_old[held_old & ~held]] = True
+            both = held & held_old
+            related.update(np.unique(labels[both].astype(np.int64) * 64
+                                     + labels_old[both]).tolist())
+    parent = list(range(64))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = i = parent[parent[i]]
+        return i
+    for ab in related:
+        parent[find(ab // 64)] = find(ab % 64)
+    dead = {find(i) for i in np.flatnonzero(separated).tolist()}
+    bonds = np.array([find(i) not in dead for i in range(64)])
+    closed = seen[:, 0].copy()
+    for i in range(0, len(seen), LABEL_BLOCK):
+        block = slice(i, i + LABEL_BLOCK)
+        glued = offset_bits(seen[block, 1]) & bonds[plane_labels(seen[block, 2:])]
+        closed[block] |= np.packbits(glued, axis=1,
+                                     bitorder="little").view(np.uint64)[:, 0]
+    return dict(zip(seen[:, 0].tolist(), closed.tolist()))
+
+
+def canonical_rotation(cube):
+    """ Smallest bitarray among all 24 rotations of given cube, or of each of
+    an array of cubes, taken in blocks to bound memory of the images. """
+    if np.ndim(cube) == 0:
+        return symmetry_images(cube)[:len(ROTATIONS)].min()
+    res = np.empty(len(cube), dtype=np.uint64)
+    for i in range(0, len(cube), LABEL_BLOCK):
+        images = symmetry_images(cube[i:i + LABEL_BLOCK])
+        res[i:i + LABEL_BLOCK] = images[:, :len(ROTATIONS)].min(axis=1)
+    return res
+
+
+def enumerate_by_splitting(metrics=NULL_METRICS, checkpoint=None):
+    """ Enumerate bandage shapes by splitting two starting branches.
+    :param checkpoint: checkpoint.Checkpoint to periodically save progress to
+        and to resume from if it holds a saved state """
     branch1 = [  1, 2, 2,
                 1, 2, 2,
                1, 2, 2,
@@ -369,10 +721,6 @@ def enumerate_by_splitting():
                  5, 6, 6,
                 5, 6, 6,
                5, 6, 6]
-    maxid = max(branch1)
-    blocks_to_split = sorted([(branch1.count(i), i) for i in range(1, maxid + 1)])
-    split(np.array(branch1, dtype=np.uint8), res, blocks_to_split, maxid)
-    print(len(res))
     branch2 = [  1, 2, 2,
                 1, 2, 2,
                1, 2, 2,
@@ -382,10 +730,21 @@ def enumerate_by_splitting():
                  3, 4, 4,
                 3, 4, 4,
                3, 4, 4]
-    maxid = max(branch2)
-    blocks_to_split = sorted([(branch2.count(i), i) for i in range(1, maxid + 1)])
-    split(np.array(branch2, dtype=np.uint8), res, blocks_to_split, maxid)
-    print(len(res))
+    res, first, stack = set(), 0, None
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None:
+        res = set(state["res"])
+        first = int(state["branch"])
+        stack = unpack_split_stack(state)
+    for k, branch in enumerate([branch1, branch2]):
+        if k < first:
+            continue
+        maxid = max(branch)
+        blocks_to_split = sorted([(branch.count(i), i)
+                                  for i in range(1, maxid + 1)])
+        with metrics.phase("split_branch%d" % (k + 1)):
+            split(np.array(branch, dtype=np.uint8), res, blocks_to_split,
+                  maxid, metrics, checkpoint, k, stack if k == first else None)
     return res
 
 
@@ -410,17 +769,56 @@ def load_cubes(path):
     return cubes
 
 
-def filter_faceturns(cubes):
-    """ Way slower than C++ version """
-    cnt = 0
+def save_shard(path, cubes, mhash=MAPPING_HASH):
+    """ Save cubes to a binary shard file. Written under a temporary name and
+    renamed, so that a shard file is either complete or missing.
+    :param mhash: mapping_hash of the mapping cubes are represented in """
+    cubes = np.asarray(cubes, dtype=np.uint64)
+    header = np.array([(SHARD_MAGIC, SHARD_VERSION, mhash, len(cubes))],
+                      dtype=SHARD_HEADER)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(header.tobytes())
+        f.write(cubes.astype('<u8').tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def shard_header(path):
+    """ Header of a binary shard file as dict. """
+    header = np.fromfile(path, dtype=SHARD_HEADER, count=1)
+    if (len(header) == 0 or header["magic"][0] != SHARD_MAGIC
+            or header["version"][0] != SHARD_VERSION):
+        raise ValueError("Not a cube shard file: %s" % path)
+    return {name: header[name][0].item() for name in SHARD_HEADER.names}
+
+
+def load_shard(path, mmap=False, mhash=MAPPING_HASH):
+    """ Load cubes from a binary shard file, optionally memory mapped so that
+    only the parts actually read end up in memory.
+    :param mhash: expected mapping_hash, None to accept any mapping """
+    header = shard_header(path)
+    if mhash is not None and header["mapping"] != mhash:
+        raise ValueError("Shard %s was stored under another MAPPING, "
+                         "convert it with remap.py" % path)
+    count = header["count"]
+    if mmap:
+        if count == 0:
+            return np.zeros(0, dtype=np.uint64)
+        return np.memmap(path, dtype='<u8', mode='r',
+                         offset=SHARD_HEADER.itemsize, shape=(count,))
+    return np.fromfile(path, dtype='<u8', count=count,
+                       offset=SHARD_HEADER.itemsize).astype(np.uint64)
+
+
+def filter_faceturns(cubes, metrics=NULL_METRICS):
+    """ Way slower than C++ version, for whole catalogues see the classes
+    stage of pipeline, which streams and resumes """
     res = []
     while cubes:
         cube = cubes.pop()
         res.append(cube)
-        cnt += 1
-        print("Exploring cube number:", cnt, "cubes left:", len(cubes))
-        verts = explore_fast(cube, TURNABLE, cubes)
-        print(len(verts))
+        explore_fast(cube, TURNABLE, cubes, metrics)
+        metrics.count("classes")
+        metrics.gauge("cubes_left", len(cubes))
     return res
 
 
@@ -441,4 +839,8 @@ def main():
                            2, 3, 4], MAPPING)
     verts, edges, edgelabels, int2cube, cube2int = explore(shape, TURNABLE)
     len(verts)
+    qverts, _, _, _, _, group, full = explore(shape, TURNABLE,
+                                              reduce_symmetry=True)
+    print("Quotient states:", len(qverts), "full states:", full,
+          "symmetry order:", len(group))
     export_graph(r"C:\temp\graph.csv", edges, edgelabels)
@@ -3,13 +3,23 @@
 #include <iostream>
 #include <fstream>
 #include <deque>
+#include <vector>
+#include <string>
 #include <map>
 #include <unordered_set>
 #include <algorithm>
 #include <utility>
+#include <chrono>
+#include <cstdio>
 
 
 const uint64_t USED_SLOTS = UINT64_C(10452854664125697535);
+const double PROGRESS_INTERVAL = 10.0;  // seconds between progress lines
+const double CHECKPOINT_INTERVAL = 600.0;  // seconds between checkpoints
+const uint64_t CHECKPOINT_MAGIC = UINT64_C(3626611884121473858);  // "BCECKPT2"
+// hash of the mapping the kernels and blockers were generated for, as
+// representation_finder.mapping_hash gives it (enumerator.MAPPING_HASH)
+const uint64_t MAPPING_HASH = UINT64_C(5691774406956421062);
 
 using edge = std::pair<int, int>;  
 enum Turns { u, f, r, d, b, l, id, x, x2, xi, y, y2, yi, xz, xz2, xzi, x2y,
@@ -27,6 +37,40 @@ uint64_t turn(Turns face, uint64_t cube);
 void save_cubes(std::vector<uint64_t>* cubes, std::string path);
 
 
+struct progress {
+    std::string phase;
+    std::chrono::steady_clock::time_point start, last;
+};
+
+
+progress start_progress(std::string phase)
+{
+    auto now = std::chrono::steady_clock::now();
+    return progress { phase, now, now };
+}
+
+
+void report_progress(progress* p, int cnt, size_t left, size_t found,
+                     bool force = false)
+{
+    // JSON line every PROGRESS_INTERVAL seconds, same format as metrics.py
+    auto now = std::chrono::steady_clock::now();
+    std::chrono::duration<double> since = now - p->last;
+    if (!force && since.count() < PROGRESS_INTERVAL) {
+        return;
+    }
+    std::chrono::duration<double> elapsed = now - p->start;
+    p->last = now;
+    std::cout << "{\"event\": \"" << (force ? "phase_end" : "progress")
+              << "\", \"phase\": \"" << p->phase
+              << "\", \"elapsed\": " << elapsed.count()
+              << ", \"counters\": {\"processed\": " << cnt
+              << "}, \"rates\": {\"processed\": " << cnt / elapsed.count()
+              << "}, \"gauges\": {\"cubes_left\": " << left
+              << ", \"set_size\": " << found << "}}" << std::endl;
+}
+
+
 graph explore_single(uint64_t initcube, std::map<Turns, uint64_t>* blockers)
 {
     std::deque<uint64_t> to_visit(1, initcube);
@@ -130,32 +174,145 @@ uint64_t explore_dfs(uint64_t initcube, std::map<Turns, uint64_t>* blockers)
 }
 
 
+bool checkpoint_due(std::chrono::steady_clock::time_point* last)
+{
+    auto now = std::chrono::steady_clock::now();
+    std::chrono::duration<double> since = now - *last;
+    if (since.count() < CHECKPOINT_INTERVAL) {
+        return false;
+    }
+    *last = now;
+    return true;
+}
+
+
+bool save_checkpoint(std::string path, int cnt,
+                     std::unordered_set<uint64_t>* cubes,
+                     std::vector<uint64_t>* res)
+{
+    // binary: magic, mapping hash, processed count, remaining count, result
+    // count, remaining, results
+    // written under temporary name and renamed once complete, so it's never
+    // torn; a failed write keeps the previous checkpoint
+    std::string tmp = path + ".tmp";
+    std::ofstream file(tmp, std::ios::binary);
+    uint64_t header[5] = { CHECKPOINT_MAGIC, MAPPING_HASH, (uint64_t) cnt,
+                           cubes->size(), res->size() };
+    file.write((char*) header, sizeof(header));
+    for(auto cube: *cubes) {
+        file.write((char*) &cube, sizeof(cube));
+    }
+    file.write((char*) res->data(), res->size() * sizeof(uint64_t));
+    file.flush();
+    bool good = file.good();
+    file.close();
+    if (!good || file.fail()) {
+        std::cout << "Writing checkpoint " << tmp << " failed" << std::endl;
+        std::remove(tmp.c_str());
+        return false;
+    }
+    if (std::rename(tmp.c_str(), path.c_str()) != 0) {
+        std::remove(path.c_str());  // windows won't rename over a file
+        if (std::rename(tmp.c_str(), path.c_str()) != 0) {
+            std::cout << "Renaming checkpoint " << tmp << " failed"
+                      << std::endl;
+            return false;
+        }
+    }
+    return true;
+}
+
+
+bool load_checkpoint(std::string path, int* cnt,
+                     std::unordered_set<uint64_t>* cubes,
+                     std::vector<uint64_t>* res)
+{
+    // state is replaced only by a complete checkpoint of the same mapping,
+    // otherwise the run starts over
+    std::ifstream file(path, std::ios::binary);
+    uint64_t header[5];
+    if (!file || !file.read((char*) header, sizeof(header))
+        || header[0] != CHECKPOINT_MAGIC) {
+        std::cout << "No valid checkpoint " << path << ", starting over"
+                  << std::endl;
+        return false;
+    }
+    if (header[1] != MAPPING_HASH) {
+        std::cout << "Checkpoint " << path << " was stored under another "
+                  << "mapping, starting over" << std::endl;
+        return false;
+    }
+    std::streamoff start = file.tellg();
+    file.seekg(0, std::ios::end);
+    uint64_t length = (uint64_t) (file.tellg() - start);
+    file.seekg(start);
+    if (header[3] > length / sizeof(uint64_t)
+        || header[4] != length / sizeof(uint64_t) - header[3]
+        || length % sizeof(uint64_t) != 0) {
+        std::cout << "Checkpoint " << path << " has wrong length, "
+                  << "starting over" << std::endl;
+        return false;
+    }
+    std::vector<uint64_t> remaining(header[3]);
+    std::vector<uint64_t> results(header[4]);
+    if (!file.read((char*) remaining.data(), header[3] * sizeof(uint64_t))
+        || !file.read((char*) results.data(), header[4] * sizeof(uint64_t))) {
+        std::cout << "Reading checkpoint " << path << " failed, "
+                  << "starting over" << std::endl;
+        return false;
+    }
+    cubes->clear();
+    cubes->insert(remaining.begin(), remaining.end());
+    res->swap(results);
+    *cnt = (int) header[2];
+    std::cout << "Resumed from checkpoint " << path << " at cube " << *cnt
+              << std::endl;
+    return true;
+}
+
+
 void filter_rotations(std::unordered_set<uint64_t>* cubes,
-                      std::map<Turns, uint64_t>* blockers)
+                      std::map<Turns, uint64_t>* blockers,
+                      std::string out_path, bool resume = false)
 {
     int cnt = 0;
     auto res = new std::vector<uint64_t>;
+    std::string ckpt_path = out_path + ".ckpt";
+    if (resume) {
+        load_checkpoint(ckpt_path, &cnt, cubes, res);
+    }
+    progress p = start_progress("filter_rotations");
+    auto last_ckpt = p.start;
     while (!cubes->empty()) {
         uint64_t cube = *cubes->begin();
         cubes->erase(cubes->begin());
         res->push_back(cube);
         explore_bfs(cube, blockers, cubes);
-        if (cnt % 1000 == 0) {
-            std::cout << cnt << std::endl;
-        }
         cnt++;
+        report_progress(&p, cnt, cubes->size(), res->size());
+        if (checkpoint_due(&last_ckpt)) {
+            save_checkpoint(ckpt_path, cnt, cubes, res);
+        }
     }
-    std::cout << "Remaining cubes:" << res->size() << std::endl;
-    save_cubes(res, "C:\\Temp\\cpp\\no_rot.txt");
+    report_progress(&p, cnt, cubes->size(), res->size(), true);
+    save_cubes(res, out_path);
+    std::remove(ckpt_path.c_str());
     delete res;
 }
 
 
 void filter_implicit_bonds(std::unordered_set<uint64_t>* cubes,
-                           std::map<Turns, uint64_t>* blockers)
+                           std::map<Turns, uint64_t>* blockers,
+                           std::string out_path, bool resume = false)
 {
     int cnt = 0;
     auto res = new std::vector<uint64_t>;
+    std::string ckpt_path = out_path + ".ckpt";
+    if (resume) {
+        load_checkpoint(ckpt_path, &cnt, cubes, res);
+    }
+    progress p = start_progress("filter_implicit_bonds");
+    auto last_ckpt = p.start;
     while (!cubes->empty()) {
         uint64_t cube = *cubes->begin();
         cubes->erase(cubes->begin());
@@ -164,13 +321,15 @@ void filter_implicit_bonds(std::unordered_set<uint64_t>* cubes,
         if (std::find(res->begin(), res->end(), cube) == res->end()) {
             res->push_back(cube);
         }
-        if (cnt % 1000 == 0) {
-            std::cout << cnt << std::endl;
-        }
         cnt++;
+        report_progress(&p, cnt, cubes->size(), res->size());
+        if (checkpoint_due(&last_ckpt)) {
+            save_checkpoint(ckpt_path, cnt, cubes, res);
+        }
     }
-    std::cout << "Remaining cubes:" << res->size() << std::endl;
-    save_cubes(res, "C:\\Temp\\cpp\\ibonds.txt");
+    report_progress(&p, cnt, cubes->size(), res->size(), true);
+    save_cubes(res, out_path);
+    std::remove(ckpt_path.c_str());
     delete res;
 }
 
@@ -218,6 +377,18 @@ void save_graph(graph results, std::string path)
 main(int argc, char const *argv[])
 {
     std::cout << "Started program..." << std::endl;
+    // usage: main [input cubes file] [output directory] [--resume]
+    std::vector<std::string> args;
+    bool resume = false;
+    for (int i = 1; i < argc; i++) {
+        if (std::string(argv[i]) == "--resume") {
+            resume = true;
+        } else {
+            args.push_back(argv[i]);
+        }
+    }
+    std::string in_path = args.size() > 0 ? args[0] : "C:\\temp\\cpp\\norot.txt";
+    std::string out_dir = args.size() > 1 ? args[1] : "C:\\temp\\cpp";
 
     std::map<Turns, uint64_t> blockers {
         {u, UINT64_C(9296555530816457730)},
@@ -234,16 +405,16 @@ main(int argc, char const *argv[])
     graph results = explore_single(bicube_fuse, &blockers);
     std::cout << "Found shapes: " << results.verts->size() << std::endl;
     std::cout << "Found edges: " << results.edges->size() << std::endl;
-    save_graph(results, "C:\\temp\\graph_cpp.csv");
+    save_graph(results, out_dir + "/graph_cpp.csv");
     explore_dfs(ibtest, &blockers);
     delete results.verts;
     delete results.edges;
     delete results.edgelabels;
 
-    std::unordered_set<uint64_t>* cubes = load_cubes("C:\\temp\\cpp\\norot.txt");
+    std::unordered_set<uint64_t>* cubes = load_cubes(in_path);
     std::cout << "Cubes loaded from file: " << cubes->size() << std::endl;
-    //filter_rotations(cubes, &blockers);
-    filter_implicit_bonds(cubes, &blockers);
+    //filter_rotations(cubes, &blockers, out_dir + "/no_rot.txt", resume);
+    filter_implicit_bonds(cubes, &blockers, out_dir + "/ibonds.txt", resume);
     delete cubes;
     std::cin.ignore();
     return 0;
@@ -0,0 +1,130 @@
+""" Progress and metrics hooks for long running passes. Functions of the
+enumerator take a metrics object and report counters (states expanded,
+duplicates hit, ...) and gauges (frontier size, set size, ...) to it, grouped
+into named phases. Metrics emits them periodically as JSON lines, NULL_METRICS
+ignores them and is the default, so disabled instrumentation costs one no-op
+method call per event. Gauges of hot loops are given as functions, set once
+before the loop and evaluated only when a line is emitted. """
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# number of count calls between checks of the clock
+CHECK_EVERY = 1024
+
+
+class NullMetrics:
+    """ Metrics sink doing nothing. """
+    enabled = False
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+    @contextmanager
+    def phase(self, name):
+        yield self
+
+    def emit(self, event="progress"):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class CounterMetrics(NullMetrics):
+    """ Metrics sink only summing counters, for worker processes whose
+    counters are added to the parent's metrics afterwards. """
+
+    def __init__(self):
+        self.counters = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+class Metrics:
+    """
+    Collects counters and gauges of the current phase and writes them as
+    JSON lines to out every interval seconds and at the end of each phase.
+    :param out:          writable text stream, stderr by default
+    :param interval:     seconds between periodic progress lines
+    :param profile_path: if given, cProfile the run and dump stats there
+    :param trace_memory: report current and peak traced memory in every line
+    """
+    enabled = True
+
+    def __init__(self, out=None, interval=10.0, profile_path=None,
+                 trace_memory=False):
+        self.out = out or sys.stderr
+        self.interval = interval
+        self.counters, self.gauges = {}, {}
+        self.phase_name = None
+        self.phase_start = self.last_emit = time.perf_counter()
+        self.last_counters = {}
+        self.ticks = 0
+        self.profile_path = profile_path
+        self.profiler = None
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        self.ticks += 1
+        if self.ticks >= CHECK_EVERY:
+            self.ticks = 0
+            if time.perf_counter() - self.last_emit >= self.interval:
+                self.emit()
+
+    def gauge(self, name, value):
+        """ :param value: number, or function returning it when emitted """
+        self.gauges[name] = value
+
+    @contextmanager
+    def phase(self, name):
+        """ Counters and gauges are reset at the start of each phase. """
+        outer = (self.phase_name, self.phase_start, self.counters, self.gauges)
+        self.phase_name, self.phase_start = name, time.perf_counter()
+        self.counters, self.gauges, self.last_counters = {}, {}, {}
+        try:
+            yield self
+        finally:
+            self.emit("phase_end")
+            self.phase_name, self.phase_start, self.counters, self.gauges = outer
+            self.last_counters = dict(self.counters)
+
+    def emit(self, event="progress"):
+        now = time.perf_counter()
+        since = now - self.last_emit
+        rates = {k: (v - self.last_counters.get(k, 0)) / since
+                 for k, v in self.counters.items()} if since > 0 else {}
+        line = {"event": event, "time": time.time(), "phase": self.phase_name,
+                "elapsed": now - self.phase_start, "counters": self.counters,
+                "rates": rates,
+                "gauges": {k: v() if callable(v) else v
+                           for k, v in self.gauges.items()}}
+        if self.trace_memory:
+            line["memory"], line["memory_peak"] = tracemalloc.get_traced_memory()
+        self.out.write(json.dumps(line) + "\n")
+        self.out.flush()
+        self.last_emit, self.last_counters = now, dict(self.counters)
+
+    def close(self):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler = None
+        if self.trace_memory:
+            tracemalloc.stop()
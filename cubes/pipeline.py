@@ -0,0 +1,348 @@
+""" Streaming end-to-end catalogue pipeline. Stages of the enumeration are
+chained through directories of binary shards instead of text files:
+    phase0   - enumeration by splitting
+    ibonds   - closure of implicit bonds
+    norot    - rotation filtering
+    classes  - face turn class filtering
+Every stage after phase0 streams its input shards in chunks through bounded
+queues, maps each chunk in a pool of worker processes, writes sorted runs and
+merges them into deduplicated output shards. Peak memory of these stages is
+set by the chunk size and the number of chunks in flight.
+Progress of every stage can be reported as JSON lines, see metrics. With
+resume, an interrupted run continues from the runs already written and from
+the phase0 checkpoint, see checkpoint. """
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+from collections import deque
+import numpy as np
+import enumerator as e
+from metrics import CounterMetrics, Metrics, NULL_METRICS
+from checkpoint import Checkpoint
+
+STAGES = ["phase0", "ibonds", "norot", "classes"]
+DEFAULT_CHUNK_SIZE = 2**16
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_CHECKPOINT_INTERVAL = 600.0
+DEFAULT_WORKERS = os.cpu_count() or 1
+INDEX = "index.json"
+
+
+def buffered(items, maxsize):
+    """ Produce items in a background thread into a bounded queue, so that
+    reading, mapping and writing of chunks overlap without piling up. """
+    done = object()
+    q = queue.Queue(maxsize)
+
+    def produce():
+        try:
+            for item in items:
+                q.put(item)
+        except BaseException as exc:
+            q.put(exc)
+        q.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def shard_paths(stagedir):
+    """ Paths of output shards of a finished stage, as listed in its index. """
+    with open(os.path.join(stagedir, INDEX)) as f:
+        index = json.load(f)
+    if index.get("mapping") != e.MAPPING_HASH:
+        raise ValueError("Stage %s was stored under another MAPPING, "
+                         "convert it with remap.py" % stagedir)
+    return [os.path.join(stagedir, s["file"]) for s in index["shards"]]
+
+
+def is_done(stagedir):
+    return os.path.exists(os.path.join(stagedir, INDEX))
+
+
+def write_index(stagedir, paths):
+    """ Index is written last, its presence marks the stage as finished. """
+    shards = [{"file": os.path.basename(p), "count": len(e.load_shard(p, True))}
+              for p in paths]
+    index = {"mapping": e.MAPPING_HASH, "shards": shards,
+             "total": sum(s["count"] for s in shards)}
+    tmp = os.path.join(stagedir, INDEX + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, os.path.join(stagedir, INDEX))
+    return index
+
+
+def iter_chunks(paths, chunk_size):
+    """ Stream cubes of given shards in chunks of at most chunk_size. """
+    for path in paths:
+        shard = e.load_shard(path, mmap=True)
+        for start in range(0, len(shard), chunk_size):
+            yield np.array(shard[start:start + chunk_size], dtype=np.uint64)
+
+
+def write_shards(cubes, stagedir, chunk_size, prefix="shard"):
+    """ Write iterable of cube chunks as shards of at most chunk_size cubes. """
+    paths, buf, size = [], [], 0
+
+    def flush():
+        path = os.path.join(stagedir, "%s_%05d.bin" % (prefix, len(paths)))
+        e.save_shard(path, np.concatenate(buf) if buf else [])
+        paths.append(path)
+
+    for chunk in cubes:
+        while len(chunk):
+            take = chunk[:chunk_size - size]
+            chunk = chunk[chunk_size - size:]
+            buf.append(take)
+            size += len(take)
+            if size == chunk_size:
+                flush()
+                buf, size = [], 0
+    if size or not paths:
+        flush()
+    return paths
+
+
+def merge_runs(runpaths, chunk_size, metrics=NULL_METRICS):
+    """ K-way merge of sorted runs dropping duplicates. Yields sorted chunks.
+    Runs are read in blocks sharing chunk_size between them, so the blocks
+    held by the merge together stay within a chunk. """
+    block = max(1, chunk_size // max(1, len(runpaths)))
+
+    def iter_run(path):
+        for chunk in iter_chunks([path], block):
+            yield from chunk.tolist()
+
+    buf, last = [], None
+    for cube in heapq.merge(*[iter_run(p) for p in runpaths]):
+        if cube != last:
+            buf.append(cube)
+            last = cube
+            if len(buf) == chunk_size:
+                metrics.count("cubes_out", len(buf))
+                yield np.array(buf, dtype=np.uint64)
+                buf = []
+    if buf:
+        metrics.count("cubes_out", len(buf))
+        yield np.array(buf, dtype=np.uint64)
+
+
+def positions_by_state(chunk):
+    """ Positions of cubes in chunk by state, that is the cube without bits
+    unused by the mapping, as produced by face turns. """
+    positions = {}
+    for i, state in enumerate((chunk & e.USED_SLOTS).tolist()):
+        positions.setdefault(state, []).append(i)
+    return positions
+
+
+def close_implicit_bonds(chunk, metrics=NULL_METRICS):
+    """ Stage ibonds: glue all implicit bonds of each cube. Implicit bonds are
+    found for a whole face turn class at once, so each class met within the
+    chunk is explored only once. """
+    res = np.empty(len(chunk), dtype=np.uint64)
+    todo = positions_by_state(chunk)
+    while todo:
+        state, positions = todo.popitem()
+        closed = e.implicit_bonds(np.uint64(state), e.TURNABLE, metrics)
+        for other in todo.keys() & closed.keys():
+            positions += todo.pop(other)
+        res[positions] = chunk[positions] | np.array(
+            [closed[s] for s in (chunk[positions] & e.USED_SLOTS).tolist()],
+            dtype=np.uint64)
+    return res
+
+
+def canonical_rotations(chunk, metrics=NULL_METRICS):
+    """ Stage norot: replace each cube by its canonical rotation. """
+    res = e.canonical_rotation(chunk)
+    metrics.count("rotated", int(np.count_nonzero(res != chunk)))
+    return res
+
+
+def class_keys(chunk, metrics=NULL_METRICS):
+    """ Stage classes: replace each cube by the smallest canonical rotation
+    of all cubes reachable by face turns. Cubes of the same face turn class met
+    within the chunk are explored only once. """
+    res = np.empty(len(chunk), dtype=np.uint64)
+    todo = positions_by_state(chunk)
+    while todo:
+        state, positions = todo.popitem()
+        states = e.explore_states(np.uint64(state), e.TURNABLE, metrics)
+        for other in todo.keys() & set(states.tolist()):
+            positions += todo.pop(other)
+        res[positions] = e.canonical_rotation(states).min()
+    return res
+
+
+STAGE_FUNCS = {"ibonds": close_implicit_bonds,
+               "norot": canonical_rotations,
+               "classes": class_keys}
+
+
+def run_phase0(stagedir, chunk_size, metrics=NULL_METRICS, checkpoint=None):
+    """ Enumeration by splitting keeps its dedup set in memory, its size is
+    fixed (see enumerate_analytic), not set by chunk size. """
+    res = e.enumerate_by_splitting(metrics, checkpoint)
+    cubes = np.fromiter(res, dtype=np.uint64, count=len(res))
+    del res
+    cubes.sort()
+    chunks = (cubes[i:i + chunk_size] for i in range(0, len(cubes), chunk_size))
+    paths = write_shards(chunks, stagedir, chunk_size)
+    if checkpoint is not None:
+        checkpoint.clear()
+    return paths
+
+
+def map_chunk(func, chunk):
+    """ Map a chunk into a sorted run in a worker process. Counters reported
+    by func are returned, to be added to the parent's metrics. """
+    counters = CounterMetrics()
+    return np.unique(func(chunk, counters)), counters.counters
+
+
+def run_stage(func, inpaths, stagedir, chunk_size, queue_size,
+              metrics=NULL_METRICS, workers=1):
+    """ Map input shards chunk by chunk into sorted runs, then merge runs.
+    Input shards are read in a background thread. With one worker, chunks
+    are mapped in the calling thread, so that profilers see the mapping; with
+    more, by a pool of worker processes with at most workers + queue_size
+    chunks in flight. Run files are complete
+    once they exist, chunks whose runs were written by an interrupted run of
+    the same chunk size are skipped. """
+    rundir = os.path.join(stagedir, "runs_%d" % chunk_size)
+    os.makedirs(rundir, exist_ok=True)
+    runpaths, pending = [], deque()
+
+    def collect():
+        path, result = pending.popleft()
+        if result is not None:
+            run, counters = result.get()
+            for name, n in counters.items():
+                metrics.count(name, n)
+            e.save_shard(path, run)
+        runpaths.append(path)
+        metrics.gauge("runs", len(runpaths))
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        chunks = buffered(iter_chunks(inpaths, chunk_size), queue_size)
+        for i, chunk in enumerate(chunks):
+            path = os.path.join(rundir, "run_%05d.bin" % i)
+            metrics.count("cubes_in", len(chunk))
+            if os.path.exists(path):
+                metrics.count("chunks_resumed")
+                pending.append((path, None))
+            elif pool is None:
+                e.save_shard(path, np.unique(func(chunk, metrics)))
+                pending.append((path, None))
+            else:
+                pending.append((path, pool.apply_async(map_chunk,
+                                                       (func, chunk))))
+            if len(pending) > workers + queue_size:
+                collect()
+        while pending:
+            collect()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    merged = merge_runs(runpaths, chunk_size, metrics)
+    paths = write_shards(merged, stagedir, chunk_size)
+    shutil.rmtree(rundir)
+    return paths
+
+
+def run_pipeline(outdir, chunk_size=DEFAULT_CHUNK_SIZE,
+                 queue_size=DEFAULT_QUEUE_SIZE, stages=STAGES,
+                 metrics=NULL_METRICS, resume=False,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, workers=1):
+    """ Run given stages, each writing shards into outdir/<stage>. Finished
+    stages are not recomputed, unfinished ones are continued with resume and
+    started over without it. Returns index of the last stage. """
+    index = None
+    for stage in stages:
+        stagedir = os.path.join(outdir, stage)
+        if is_done(stagedir):
+            print("Stage %s already done, skipping" % stage)
+            continue
+        if os.path.exists(stagedir) and not resume:  # unfinished run
+            shutil.rmtree(stagedir)
+        os.makedirs(stagedir, exist_ok=True)
+        with metrics.phase(stage):
+            if stage == "phase0":
+                checkpoint = Checkpoint(os.path.join(stagedir, "split.npz"),
+                                        e.MAPPING_HASH, checkpoint_interval,
+                                        resume)
+                paths = run_phase0(stagedir, chunk_size, metrics, checkpoint)
+            else:
+                prevdir = os.path.join(outdir, STAGES[STAGES.index(stage) - 1])
+                paths = run_stage(STAGE_FUNCS[stage], shard_paths(prevdir),
+                                  stagedir, chunk_size, queue_size, metrics,
+                                  workers)
+            index = write_index(stagedir, paths)
+            metrics.gauge("set_size", index["total"])
+        print("Stage %s done, cubes: %d" % (stage, index["total"]))
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split(".")[0])
+    parser.add_argument("outdir", help="directory for stage shard directories")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="cubes per chunk and per output shard")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="chunks buffered between stage steps")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="stages to run, previous ones must be done")
+    parser.add_argument("--progress", type=float, metavar="SECONDS",
+                        help="write progress JSON lines every SECONDS")
+    parser.add_argument("--progress-file", metavar="PATH",
+                        help="write progress lines to PATH instead of stderr")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="dump cProfile stats of the run to PATH, "
+                             "chunks are then mapped in this process")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="report traced memory in progress lines, "
+                             "chunks are then mapped in this process")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run instead of "
+                             "starting unfinished stages over")
+    parser.add_argument("--checkpoint-interval", type=float,
+                        default=DEFAULT_CHECKPOINT_INTERVAL, metavar="SECONDS",
+                        help="seconds between phase0 checkpoints")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="processes mapping chunks of stages after phase0")
+    args = parser.parse_args(argv)
+
+    metrics = NULL_METRICS
+    workers = args.workers
+    if args.profile or args.trace_memory:  # they only see this process
+        workers = 1
+    out = open(args.progress_file, "a") if args.progress_file else None
+    if args.progress or args.profile or args.trace_memory:
+        metrics = Metrics(out, args.progress or float("inf"), args.profile,
+                          args.trace_memory)
+    try:
+        run_pipeline(args.outdir, args.chunk_size, args.queue_size,
+                     args.stages, metrics, args.resume,
+                     args.checkpoint_interval, workers)
+    finally:
+        metrics.close()
+        if out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+""" Bulk re-mapping of stored catalogues when MAPPING changes. The bit
+permutation from old to new mapping is generated as mask/shift code by
+representation_finder.gencode_remap and applied to whole shards at once.
+Shards of finished pipeline stages are rewritten in place with the new mapping
+hash in their header, shards already carrying it are skipped. Stages norot and
+classes store canonical representatives, the smallest bitarray over rotations
+or over a face turn class, which depends on the mapping. After the bit move
+they are canonicalized again into a fresh stage directory, which then replaces
+the old one; this needs the new mapping to be enumerator.MAPPING, otherwise
+those stages are removed to be rerun. Runs and shards of unfinished stages
+are removed, their checkpoints are remapped to be resumed from. A stage index
+gets the new mapping hash once the stage is converted, so an interrupted
+remap can simply be run again. """
+import argparse
+import glob
+import json
+import os
+import shutil
+import numpy as np
+import enumerator as e
+import pipeline
+from checkpoint import Checkpoint
+from representation_finder import gencode_remap, mapping_hash
+
+# arrays of cubes in checkpoint states, the rest doesn't depend on the mapping
+CHECKPOINT_CUBES = ["res", "remaining"]
+
+# stages storing canonical representatives and their canonicalizing functions
+CANONICAL_STAGES = {"norot": pipeline.canonical_rotations,
+                    "classes": pipeline.class_keys}
+
+
+def load_mapping(spec):
+    """ Mapping from JSON file, or enumerator.MAPPING for 'current'. """
+    if spec == "current":
+        return dict(e.MAPPING)
+    with open(spec) as f:
+        return json.load(f)
+
+
+def remap_func(old, new):
+    """ Compile vectorized remap of cube arrays from old to new mapping. """
+    if old.keys() != new.keys():
+        raise ValueError("Mappings differ in their pairs")
+    namespace = {"np": np}
+    exec(gencode_remap(old, new), namespace)
+    return namespace["remap"]
+
+
+def remap_shard(path, remap, old_hash, new_hash):
+    """ Remap one shard in place, shards are sorted again as the order of
+    cubes changes. Returns False if the shard was remapped already. """
+    found = e.shard_header(path)["mapping"]
+    if found == new_hash:
+        return False
+    if found != old_hash:
+        raise ValueError("Shard %s was stored under neither mapping" % path)
+    cubes = remap(e.load_shard(path, mhash=old_hash))
+    cubes.sort()
+    e.save_shard(path, cubes, new_hash)
+    return True
+
+
+def set_index_mapping(stagedir, mhash):
+    index_path = os.path.join(stagedir, pipeline.INDEX)
+    with open(index_path) as f:
+        index = json.load(f)
+    index["mapping"] = mhash
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def remap_checkpoint(path, remap, old_hash, new_hash):
+    """ Remap cube arrays of a checkpoint in place. Returns False if the
+    checkpoint was remapped already. """
+    try:
+        Checkpoint(path, new_hash, resume=True).load()
+        return False
+    except ValueError:
+        state = Checkpoint(path, old_hash, resume=True).load()
+    for name in CHECKPOINT_CUBES:
+        if name in state:
+            state[name] = remap(state[name].astype(np.uint64))
+    Checkpoint(path, new_hash).save(**state)
+    return True
+
+
+def reset_unfinished(stagedir, remap, old_hash, new_hash):
+    """ Remove runs and shards of an unfinished stage, remap its checkpoints
+    so that it can still be resumed from them. """
+    for rundir in glob.glob(os.path.join(stagedir, "runs_*")):
+        shutil.rmtree(rundir)
+    for path in glob.glob(os.path.join(stagedir, "*.bin")):
+        os.remove(path)
+    for path in glob.glob(os.path.join(stagedir, "*.npz")):
+        if remap_checkpoint(path, remap, old_hash, new_hash):
+            print("Remapped checkpoint", path)
+
+
+def canonicalize_stage(stage, stagedir, chunk_size, queue_size, workers=1):
+    """ Rebuild a remapped stage of canonical representatives through its
+    stage function, the result replaces stagedir. """
+    tmpdir = stagedir + ".remap"
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    paths = pipeline.run_stage(CANONICAL_STAGES[stage],
+                               [os.path.join(stagedir, f) for f in
+                                sorted(os.listdir(stagedir))
+                                if f.endswith(".bin")],
+                               tmpdir, chunk_size, queue_size,
+                               workers=workers)
+    pipeline.write_index(tmpdir, paths)
+    os.rename(stagedir, stagedir + ".old")
+    os.rename(tmpdir, stagedir)
+    shutil.rmtree(stagedir + ".old")
+
+
+def remap_catalogue(root, old, new, chunk_size=pipeline.DEFAULT_CHUNK_SIZE,
+                    queue_size=pipeline.DEFAULT_QUEUE_SIZE, workers=1):
+    """ Remap all stage directories of a pipeline output directory. """
+    remap = remap_func(old, new)
+    old_hash, new_hash = mapping_hash(old), mapping_hash(new)
+    cnt = 0
+    for stage in pipeline.STAGES:
+        stagedir = os.path.join(root, stage)
+        if os.path.exists(stagedir + ".old"):  # crashed while replacing
+            if not os.path.exists(stagedir):
+                os.rename(stagedir + ".remap", stagedir)
+            shutil.rmtree(stagedir + ".old")
+        if not os.path.exists(stagedir):
+            continue
+        if not pipeline.is_done(stagedir):
+            reset_unfinished(stagedir, remap, old_hash, new_hash)
+            continue
+        with open(os.path.join(stagedir, pipeline.INDEX)) as f:
+            if json.load(f).get("mapping") == new_hash:
+                continue
+        if stage in CANONICAL_STAGES and new_hash != e.MAPPING_HASH:
+            print("Stage %s can only be canonicalized under the current "
+                  "MAPPING, removing it to be rerun" % stage)
+            shutil.rmtree(stagedir)
+            continue
+        for path in sorted(glob.glob(os.path.join(stagedir, "*.bin"))):
+            cnt += remap_shard(path, remap, old_hash, new_hash)
+        if stage in CANONICAL_STAGES:
+            canonicalize_stage(stage, stagedir, chunk_size, queue_size,
+                               workers)
+            print("Stage %s canonicalized again" % stage)
+        else:
+            set_index_mapping(stagedir, new_hash)
+    print("Remapped shards:", cnt)
+    return cnt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split(".")[0])
+    parser.add_argument("root", help="pipeline output directory")
+    parser.add_argument("--old", required=True,
+                        help="JSON file with mapping the catalogue is stored "
+                             "in, or 'current' for enumerator.MAPPING")
+    parser.add_argument("--new", required=True,
+                        help="JSON file with mapping to convert to, or "
+                             "'current' for enumerator.MAPPING")
+    parser.add_argument("--chunk-size", type=int,
+                        default=pipeline.DEFAULT_CHUNK_SIZE,
+                        help="cubes per chunk when canonicalizing stages")
+    parser.add_argument("--queue-size", type=int,
+                        default=pipeline.DEFAULT_QUEUE_SIZE,
+                        help="chunks buffered when canonicalizing stages")
+    parser.add_argument("--workers", type=int,
+                        default=pipeline.DEFAULT_WORKERS,
+                        help="processes canonicalizing stages")
+    args = parser.parse_args(argv)
+    remap_catalogue(args.root, load_mapping(args.old), load_mapping(args.new),
+                    args.chunk_size, args.queue_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
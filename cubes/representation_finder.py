@@ -1,5 +1,9 @@
 """ Find mappings of adjacent cubie pairs into 64-bit register positions
 minimizing number of instructions needed for face turn permutations. """
+import functools
+import hashlib
+import timeit
+import numpy as np
 
 CYCLES_ALL = [['uFr', 'ubR', 'uBl', 'ufL'], ['uFr', 'Ubr', 'dBr', 'Dfr'],
               ['Ufl', 'dfL', 'Dfr', 'ufR'], ['ufR', 'uBr', 'ubL', 'uFl'],
@@ -10,6 +14,30 @@ CYCLES_ALL = [['uFr', 'ubR', 'uBl', 'ufL'], ['uFr', 'Ubr', 'dBr', 'Dfr'],
               ['uf', 'ur', 'ub', 'ul'], ['fu', 'fr', 'fd', 'fl'],
               ['ru', 'rb', 'rd', 'rf'], ['df', 'dr', 'db', 'dl'],
               ['bu', 'br', 'bd', 'bl'], ['lu', 'lb', 'ld', 'lf']]
+# pairs permuted by cube rotations around three axes and by the reflection
+ROT_CYCLES = {"x": [["dBr", "Dfr", "uFr", "Ubr"], ["uBr", "Dbr", "dFr", "Ufr"],
+                    ["ru", "rb", "rd", "rf"], ["uFl", "Ubl", "dBl", "Dfl"],
+                    ["Dbl", "dFl", "Ufl", "uBl"], ["lu", "lb", "ld", "lf"],
+                    ["fu", "ub", "bd", "df"], ["fd", "uf", "bu", "db"],
+                    ["fl", "ul", "bl", "dl"], ["fr", "ur", "br", "dr"],
+                    ["ufL", "ubL", "dbL", "dfL"], ["ufR", "ubR", "dbR", "dfR"]],
+              "y": [["Ufl", "ufR", "Dfr", "dfL"], ["dfR", "Dfl", "ufL", "Ufr"],
+                    ["fu", "fr", "fd", "fl"], ["Dbr", "dbL", "Ubl", "ubR"],
+                    ["ubL", "Ubr", "dbR", "Dbl"], ["bd", "bl", "bu", "br"],
+                    ["ul", "ru", "dr", "ld"], ["ur", "rd", "dl", "lu"],
+                    ["uf", "rf", "df", "lf"], ["ub", "rb", "db", "lb"],
+                    ["uFl", "uFr", "dFr", "dFl"], ["uBl", "uBr", "dBr", "dBl"]],
+              "z": [["uFr", "ubR", "uBl", "ufL"], ["ufR", "uBr", "ubL", "uFl"],
+                    ["uf", "ur", "ub", "ul"], ["dfL", "dFr", "dbR", "dBl"],
+                    ["dfR", "dBr", "dbL", "dFl"], ["df", "dr", "db", "dl"],
+                    ["fl", "rf", "br", "lb"], ["fr", "rb", "bl", "lf"],
+                    ["fu", "ru", "bu", "lu"], ["fd", "rd", "bd", "ld"],
+                    ["Ufl", "Ufr", "Ubr", "Ubl"], ["Dfl", "Dfr", "Dbr", "Dbl"]]}
+MIRROR_CYCLES = [["uFr", "uFl"], ["uBr", "uBl"], ["ufR", "ufL"], ["ubR", "ubL"],
+                 ["ul", "ur"], ["dFr", "dFl"], ["dBr", "dBl"], ["dfR", "dfL"],
+                 ["dbR", "dbL"], ["dl", "dr"], ["fl", "fr"], ["bl", "br"],
+                 ["ru", "lu"], ["rf", "lf"], ["rd", "ld"], ["rb", "lb"],
+                 ["Dfr", "Dfl"], ["Dbr", "Dbl"], ["Ufr", "Ufl"], ["Ubr", "Ubl"]]
 # old order:
 # cycles = [['uFr', 'ubR', 'uBl', 'ufL'], ['uFr', 'Ubr', 'dBr', 'Dfr'],
 #           ['ufL', 'Dfl', 'dfR', 'Ufr'], ['dFl', 'dbL', 'dBr', 'dfR'],
@@ -38,7 +66,9 @@ def update_width(mapping, pos):
     return mapping["max"] - mapping["min"]
 
 
-def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
+def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21,
+                objective=None, max_score=None, keep_best=False, best=None,
+                bound=None):
     """
     Take partial assignment of bit offsets (integers 0..63) and try to place
     pairs of a next cycle. If all pairs are placed reasonably well, add mapping
@@ -52,15 +82,42 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                          difference. In practice we can't achieve this for each
                          face so we relax on requiring this criterion somewhat.
     :param max_diff:     maximum arithmetic difference of bit offsets in a cycle
+    :param objective:    function (mapping, cycles) -> score of a complete
+                         mapping, check_map by default, see also kernel_cost
+                         and kernel_time
+    :param max_score:    mappings scoring at least this are dropped, 12 for
+                         check_map and no limit for other objectives by
+                         default
+    :param keep_best:    search exhaustively adding only mappings scoring
+                         better than all found before, so that the last one in
+                         maps is the best. Otherwise the search stops after
+                         about 100 mappings scoring below max_score
+    :param best:         score to beat, shared by recursive calls
+    :param bound:        function (mapping, cycles) -> lower bound of the
+                         objective of all completions of a partial mapping,
+                         evaluated on all cycles. Partial mappings not
+                         beating best are pruned. kernel_cost bounds itself,
+                         as it counts only kernels whose pairs are all placed
     :return              none, mutates maps object
     """
-    if len(maps) > 100:
+    if max_score is None:
+        max_score = 12 if objective in (None, check_map) else float("inf")
+    objective = objective or check_map
+    best = best or [max_score]
+    opts = {"max_diff": max_diff, "objective": objective,
+            "keep_best": keep_best, "best": best, "bound": bound}
+    if not keep_best and len(maps) > 100:
+        return
+    if bound is not None and bound(currmap, CYCLES_ALL) >= best[0]:
         return
     if not cycles_left:
         cmin = currmap["min"]
         if currmap["max"] - cmin < 64:
-            cyc = cycles if len(currmap) < 30 else CYCLES_ALL  # phase2
-            if check_map(currmap, cyc) < 12:
+            cyc = CYCLES_ALL[:12] if len(currmap) < 30 else CYCLES_ALL  # phase2
+            score = objective(currmap, cyc)
+            if score < best[0]:
+                if keep_best:
+                    best[0] = score
                 del currmap["max"], currmap["min"]
                 maps.append({k: v - cmin for k, v in currmap.items()})
         return
@@ -77,7 +134,8 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
             if 1 == (i2 - i1) % 2 == (i3 - i2) % 2:  # order check
                 #if not facediff[face] or (facediff[face] == p2 - p1):
                 # cross face compat check
-                place_cycle(cycles_left[1:], currmap, nonfree, facediff, maps)
+                place_cycle(cycles_left[1:], currmap, nonfree, facediff, maps,
+                            **opts)
 
     elif len(placed) == 3:
         fst, snd, trd = sorted([currmap[p[1]] for p in placed])
@@ -97,7 +155,7 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
             newm = {**currmap, toplace[0][1]: pos[0]}
             newnf = nonfree.copy()
             newnf.update(pos)
-            place_cycle(cycles_left[1:], newm, newnf, newfd, maps)
+            place_cycle(cycles_left[1:], newm, newnf, newfd, maps, **opts)
 
         for pos in [[trd + trd - snd], [fst - (trd - snd)]]:  # fill around
             if any(p in nonfree for p in pos):
@@ -107,7 +165,7 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                 newnf = nonfree.copy()
                 newnf.update(pos)
                 newfd = {**facediff, face: trd - snd}
-                place_cycle(cycles_left[1:], newm, newnf, newfd, maps)
+                place_cycle(cycles_left[1:], newm, newnf, newfd, maps, **opts)
 
     elif len(placed) == 2:
         (i1, fst), (i2, snd) = sorted([(i, currmap[p]) for i, p in placed],
@@ -129,7 +187,8 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                     newnf = nonfree.copy()
                     newnf.update(pos)
                     newfd = {**facediff, face: d // 3}
-                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps)
+                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps,
+                                **opts)
 
             if not facediff[face] or (facediff[face] == d):
                 newfd = {**facediff, face: d}
@@ -143,7 +202,8 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                         continue
                     newnf = nonfree.copy()
                     newnf.update(pos)
-                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps)
+                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps,
+                                **opts)
 
         else:  # opposing pairs placed
             if d % 2 == 1:
@@ -163,7 +223,8 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                     width = update_width(newm, pos)
                     if width > 63:
                         continue
-                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps)
+                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps,
+                                **opts)
 
     elif len(placed) == 1:
         p1 = currmap[placed[0][1]]
@@ -196,7 +257,8 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                         continue
                     newnf = nonfree.copy()
                     newnf.update(pos)
-                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps)
+                    place_cycle(cycles_left[1:], newm, newnf, newfd, maps,
+                                **opts)
 
     elif len(placed) == 0:
         if len(cycle[0]) == 3:  # first cycle
@@ -206,7 +268,7 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                 newnf = nonfree.copy()
                 newnf.update([0, d, 2 * d, 3 * d])
                 newfd = {**facediff, face: d}
-                place_cycle(cycles_left[1:], newm, newnf, newfd, maps)
+                place_cycle(cycles_left[1:], newm, newnf, newfd, maps, **opts)
         else:  # the isolated cycles
             start = currmap["min"] - 40
             ds = [facediff[face]]
@@ -223,7 +285,8 @@ def place_cycle(cycles_left, currmap, nonfree, facediff, maps, max_diff=21):
                         continue
                     newnf = nonfree.copy()
                     newnf.update(pos)
-                    place_cycle(cycles_left[1:], newm, newnf, facediff, maps)
+                    place_cycle(cycles_left[1:], newm, newnf, facediff, maps,
+                                **opts)
 
 
 def check_map(mapping, cycles, printout=False):
@@ -242,6 +305,116 @@ def check_map(mapping, cycles, printout=False):
     return score
 
 
+def face_diffs(mapping, cycles):
+    """ Offset difference of the first cycle of each face, to continue the
+    search from a mapping of these cycles. """
+    diffs = {}
+    for f in "ufrdlb":
+        for c in [c for c in cycles if all(f in pair for pair in c)]:
+            sind = sorted(mapping[p] for p in c)
+            diffs.setdefault(f, sind[1] - sind[0])
+    return diffs
+
+
+def fits_64(mapping):
+    """ Whether bit offsets of mapping are distinct and fit a 64-bit register,
+    i.e. can be shared with USED_SLOTS masks. """
+    vals = [v for k, v in mapping.items() if k not in ("max", "min")]
+    return len(set(vals)) == len(vals) and max(vals) - min(vals) < 64
+
+
+def kernel_terms(mapping, cycles=CYCLES_ALL):
+    """ Number of mask/shift terms gencode_cycles emits for each face turn,
+    rotation and mirror kernel. Kernels moving pairs not mapped yet (partial
+    mappings during search) are left out. """
+    pairs = {k: v for k, v in mapping.items() if k not in ("max", "min")}
+    terms = {}
+    for name, kcycles, kpairs in kernel_pairs(tuple(map(tuple, cycles))):
+        if kpairs.issubset(pairs):
+            shifts, rest = cycle_shifts(kcycles, pairs)
+            terms[name] = len(shifts) + (rest > 0)
+    return terms
+
+
+@functools.lru_cache()
+def kernel_pairs(cycles):
+    """ Cached kernel_cycles with the set of pairs each kernel moves, as
+    kernel_terms runs on every node of the search. """
+    return [(name, kcycles, frozenset(p for c in kcycles for p in c))
+            for name, kcycles in kernel_cycles(cycles).items()]
+
+
+def kernel_cost(mapping, cycles=CYCLES_ALL, weights=None):
+    """ Search objective: total number of generated terms, infinite if the
+    mapping doesn't fit in 64 bits.
+    :param weights: dict {kernel name: weight}, e.g. to count only face turns
+                    which dominate exploration, missing kernels weigh 1 """
+    if not fits_64(mapping):
+        return float("inf")
+    weights = weights or {}
+    return sum(weights.get(name, 1) * terms
+               for name, terms in kernel_terms(mapping, cycles).items())
+
+
+def kernel_time(mapping, cycles=CYCLES_ALL, nstates=1000, repeat=3):
+    """ Search objective: microbenchmark of generated Python kernels, seconds
+    to run all of them on a single state. Infinite if the mapping doesn't fit
+    in 64 bits. Much slower than kernel_cost. """
+    if not fits_64(mapping):
+        return float("inf")
+    pairs = {k: v for k, v in mapping.items() if k not in ("max", "min")}
+    cmin = min(pairs.values())
+    pairs = {k: v - cmin for k, v in pairs.items()}
+    names = kernel_terms(pairs, cycles).keys()
+    namespace = {"np": np}
+    kcycles = kernel_cycles(cycles)
+    exec("\n\n".join(gencode_cycles(kcycles[n], pairs, n) for n in names),
+         namespace)
+    kernels = [namespace["turn_" + n] for n in names]
+    used = np.uint64(sum(2**v for v in pairs.values()))
+    rng = np.random.default_rng(0)
+    states = [np.bitwise_and(s, used) for s in
+              rng.integers(0, 2**63, nstates, dtype=np.uint64)]
+
+    def run():
+        for kernel in kernels:
+            for state in states:
+                kernel(state)
+
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / nstates
+
+
+def compare_mappings(mappings, cycles=CYCLES_ALL, measure=False,
+                     printout=True):
+    """ Report comparing candidate mappings given as dict {name: mapping}, sorted
+    by kernel_cost. Rows are dicts with check_map score, generated terms of face
+    turns, rotations and mirror, total terms, width and optionally measured
+    kernel time. """
+    rows = []
+    for name, mapping in mappings.items():
+        terms = kernel_terms(mapping, cycles)
+        vals = [v for k, v in mapping.items() if k not in ("max", "min")]
+        rows.append({"name": name,
+                     "diffs": check_map(mapping, cycles),
+                     "face_terms": sum(terms.get(f, 0) for f in "ufrdlb"),
+                     "rot_terms": sum(v for k, v in terms.items()
+                                      if k[0] in "xyz"),
+                     "mir_terms": terms.get("mir", 0),
+                     "cost": kernel_cost(mapping, cycles),
+                     "width": max(vals) - min(vals) + 1,
+                     "time": kernel_time(mapping, cycles) if measure else None})
+    rows.sort(key=lambda r: r["cost"])
+    if printout:
+        print("{0:>12} {1:>5} {2:>5} {3:>5} {4:>5} {5:>6} {6:>5} {7:>10}".format(
+            "mapping", "diffs", "face", "rot", "mir", "cost", "width", "us/state"))
+        for r in rows:
+            time = "-" if r["time"] is None else "%.1f" % (r["time"] * 1e6)
+            print("{0:>12} {1:>5} {2:>5} {3:>5} {4:>5} {5:>6} {6:>5} {7:>10}".format(
+                str(r["name"])[:12], r["diffs"], r["face_terms"], r["rot_terms"],
+                r["mir_terms"], r["cost"], r["width"], time))
+    return rows
+
+
 def gencode_mapliteral(cycles, mapping):
     """ Generate nicely formatted mapping literal. """
     code = "MAPPING = {"
@@ -254,14 +427,22 @@ def gencode_mapliteral(cycles, mapping):
     return code[:-13] + '}'
 
 
-def gencode_cycles(cycles, mapping, postfix, py=True):
-    """ Generate bitwise arithmetic-heavy code implementing permutation composed
-    of given cycles. Generates Python or C++ code. """
+def cycle_shifts(cycles, mapping):
+    """ Masks of bits moved by the same shift in permutation composed of given
+    cycles, as dict {shift: mask}, and mask of bits left in place. """
     shifts = {}
     for c in cycles:
         for i in range(len(c)):
             diff = mapping[c[i]] - mapping[c[(i + 1) % len(c)]]
             shifts[diff] = shifts.get(diff, 0) + 2**mapping[c[i]]
+    resti = set(mapping.values()) - set([mapping[p] for c in cycles for p in c])
+    return shifts, sum(2**i for i in resti)
+
+
+def gencode_cycles(cycles, mapping, postfix, py=True):
+    """ Generate bitwise arithmetic-heavy code implementing permutation composed
+    of given cycles. Generates Python or C++ code. """
+    shifts, rest = cycle_shifts(cycles, mapping)
     if py:
         code = "def turn_{0}(cube):\n    return np.bitwise_or.reduce([{1}])"
         shift_code = "\n        np.{0}_shift(np.bitwise_and(cube, np.uint64({1})), np.uint64({2})), "
@@ -274,8 +455,6 @@ def gencode_cycles(cycles, mapping, postfix, py=True):
             transf += shift_code.format("left" if s < 0 else "right", mask, abs(s))
         else:
             transf += shift_code.format("<<" if s < 0 else ">>", mask, abs(s))
-    resti = set(mapping.values()) - set([mapping[p] for c in cycles for p in c])
-    rest = sum(2**i for i in resti)
     if rest > 0:
         if py:
             transf += "\n        np.bitwise_and(cube, np.uint64({0}))".format(rest)
@@ -287,21 +466,75 @@ def gencode_cycles(cycles, mapping, postfix, py=True):
     return code
 
 
+def mapping_hash(mapping):
+    """ Stable 64-bit fingerprint of a mapping, stored in shard headers. """
+    items = sorted((k, v) for k, v in mapping.items() if k not in ("max", "min"))
+    digest = hashlib.sha1(repr(items).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def gencode_remap(old, new, py=True):
+    """ Generate code moving bit of every pair from its offset in old mapping
+    to its offset in new mapping. Bits not used by old mapping go to those not
+    used by new mapping in the same order, so that they survive a round trip
+    (enumeration by splitting leaves them set). Python version works on whole
+    numpy arrays of cubes at once. """
+    pairs = [k for k in old if k not in ("max", "min")]
+    unused_old = sorted(set(range(64)) - set(old[k] for k in pairs))
+    unused_new = sorted(set(range(64)) - set(new[k] for k in pairs))
+    moves = [(old[k], new[k]) for k in pairs] + list(zip(unused_old, unused_new))
+    shifts = {}
+    for pos, newpos in moves:
+        diff = pos - newpos
+        shifts[diff] = shifts.get(diff, 0) | 2**pos
+    if py:
+        code = "def remap(cubes):\n    return ({0})"
+        shift_code = "\n        ((cubes & np.uint64({1})) {0} np.uint64({2})) |"
+        rest_code = "\n        (cubes & np.uint64({0})) |"
+    else:
+        code = "uint64_t remap(uint64_t cube)\n{{\n    return {0};\n}}"
+        shift_code = "\n        ((cube & UINT64_C({1})) {0} {2}) |"
+        rest_code = "\n        (cube & UINT64_C({0})) |"
+    transf = ""
+    for s, mask in shifts.items():
+        if s == 0:
+            transf += rest_code.format(mask)
+        else:
+            transf += shift_code.format("<<" if s < 0 else ">>", mask, abs(s))
+    return code.format(transf[:-2])
+
+
 def gencode_mirror(mapping, py=True):
     """ Generate code for the single needed cube reflection. """
-    cycles = [["uFr", "uFl"], ["uBr", "uBl"], ["ufR", "ufL"], ["ubR", "ubL"],
-              ["ul", "ur"], ["dFr", "dFl"], ["dBr", "dBl"], ["dfR", "dfL"],
-              ["dbR", "dbL"], ["dl", "dr"], ["fl", "fr"], ["bl", "br"],
-              ["ru", "lu"], ["rf", "lf"], ["rd", "ld"], ["rb", "lb"],
-              ["Dfr", "Dfl"], ["Dbr", "Dbl"], ["Ufr", "Ufl"], ["Ubr", "Ubl"]]
-    return gencode_cycles(cycles, mapping, "mir", py=py)
+    return gencode_cycles(MIRROR_CYCLES, mapping, "mir", py=py)
+
+
+def face_cycles(cycles):
+    """ Split cycles by the face whose turn they make up. """
+    return {face: [c for c in cycles if all(face in pair for pair in c)]
+            for face in "ufrdlb"}
+
+
+def rotation_cycles():
+    """ Cycles of all quarter and half turn rotations keyed by code postfix. """
+    rots = {}
+    for axis in "xyz":
+        cycles = ROT_CYCLES[axis]
+        rots[axis] = cycles
+        rots[axis + "i"] = [list(reversed(c)) for c in cycles]
+        rots[axis + "2"] = [d for c in cycles for d in ([c[0], c[2]], [c[1], c[3]])]
+    return rots
+
+
+def kernel_cycles(cycles):
+    """ Cycles of every generated kernel: face turns, rotations, mirror. """
+    return {**face_cycles(cycles), **rotation_cycles(), "mir": MIRROR_CYCLES}
 
 
 def gencode_faceturns(cycles, mapping, py=True):
     """ Generate code for face turns. """
     code = ""
-    for face in "ufrdlb":
-        facecycles = [c for c in cycles if all(face in pair for pair in c)]
+    for face, facecycles in face_cycles(cycles).items():
         code = code + "\n\n" + gencode_cycles(facecycles, mapping, face, py=py)
     return code
 
@@ -309,31 +542,8 @@ def gencode_faceturns(cycles, mapping, py=True):
 def gencode_rots(mapping, py=True):
     """ Generate code for cube rotations. """
     code = ""
-    cycles = {"x": [["dBr", "Dfr", "uFr", "Ubr"], ["uBr", "Dbr", "dFr", "Ufr"],
-                    ["ru", "rb", "rd", "rf"], ["uFl", "Ubl", "dBl", "Dfl"],
-                    ["Dbl", "dFl", "Ufl", "uBl"], ["lu", "lb", "ld", "lf"],
-                    ["fu", "ub", "bd", "df"], ["fd", "uf", "bu", "db"],
-                    ["fl", "ul", "bl", "dl"], ["fr", "ur", "br", "dr"],
-                    ["ufL", "ubL", "dbL", "dfL"], ["ufR", "ubR", "dbR", "dfR"]],
-              "y": [["Ufl", "ufR", "Dfr", "dfL"], ["dfR", "Dfl", "ufL", "Ufr"],
-                    ["fu", "fr", "fd", "fl"], ["Dbr", "dbL", "Ubl", "ubR"],
-                    ["ubL", "Ubr", "dbR", "Dbl"], ["bd", "bl", "bu", "br"],
-                    ["ul", "ru", "dr", "ld"], ["ur", "rd", "dl", "lu"],
-                    ["uf", "rf", "df", "lf"], ["ub", "rb", "db", "lb"],
-                    ["uFl", "uFr", "dFr", "dFl"], ["uBl", "uBr", "dBr", "dBl"]],
-              "z": [["uFr", "ubR", "uBl", "ufL"], ["ufR", "uBr", "ubL", "uFl"],
-                    ["uf", "ur", "ub", "ul"], ["dfL", "dFr", "dbR", "dBl"],
-                    ["dfR", "dBr", "dbL", "dFl"], ["df", "dr", "db", "dl"],
-                    ["fl", "rf", "br", "lb"], ["fr", "rb", "bl", "lf"],
-                    ["fu", "ru", "bu", "lu"], ["fd", "rd", "bd", "ld"],
-                    ["Ufl", "Ufr", "Ubr", "Ubl"], ["Dfl", "Dfr", "Dbr", "Dbl"]]}
-    cyclesi = {axis: [list(reversed(c)) for c in cycles[axis]] for axis in "xyz"}
-    cycles2 = {axis: [[[c[0], c[2]], [c[1], c[3]]] for c in cycles[axis]] for axis in "xyz"}
-    cycles2 = {axis: [d for c in cycles2[axis] for d in c] for axis in "xyz"}
-    for rot in "xyz":
-        code += "\n\n" + gencode_cycles(cycles[rot], mapping, rot, py=py)
-        code += "\n\n" + gencode_cycles(cyclesi[rot], mapping, rot + "i", py=py)
-        code += "\n\n" + gencode_cycles(cycles2[rot], mapping, rot + "2", py=py)
+    for rot, cycles in rotation_cycles().items():
+        code += "\n\n" + gencode_cycles(cycles, mapping, rot, py=py)
     return code
 
 
@@ -357,6 +567,8 @@ def gencode_blockers(mapping):
 
 
 def main():
+    from enumerator import CYCLES, MAPPING  # enumerator imports this module
+
     # calculation of optimal placements
     maps = []
     cycles = CYCLES_ALL[:12]
@@ -376,6 +588,22 @@ def main():
     len(maps2)
     min([check_map(m, CYCLES_ALL) for m in maps2])
 
+    # pick the mapping with cheapest generated kernels instead of tidiest one,
+    # extending the cheapest placement of corner-edge pairs by center-edge ones
+    maps3 = []
+    search(cycles, maps3, objective=kernel_cost, keep_best=True)
+    vals = maps3[-1].values()
+    maps4 = []
+    place_cycle(cycles2,
+                {"max": max(vals), "min": min(vals), **maps3[-1]},
+                set(vals),
+                face_diffs(maps3[-1], cycles),
+                maps4, objective=kernel_cost, keep_best=True,
+                bound=kernel_cost)
+    candidates = {"tidy_%d" % i: m for i, m in enumerate(maps2)}
+    candidates.update({"current": MAPPING, "cheapest": maps4[-1]})
+    compare_mappings(candidates, measure=True)
+
     # generate C++ code for enumerator based on selected mapping
     print(gencode_blockers(MAPPING))
     print(gencode_faceturns(CYCLES, MAPPING, py=False))
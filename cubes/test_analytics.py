@@ -0,0 +1,48 @@
+""" Regression checks of bit-parallel BFS against plain breadth-first search
+from every state of bicube_fuse. """
+from collections import deque
+import numpy as np
+import pytest
+import enumerator as e
+import analytics
+
+
+def naive_distances(indptr, indices, source):
+    dist = np.full(len(indptr) - 1, -1)
+    dist[source] = 0
+    tovisit = deque([source])
+    while tovisit:
+        v = tovisit.popleft()
+        for w in indices[indptr[v]:indptr[v + 1]]:
+            if dist[w] < 0:
+                dist[w] = dist[v] + 1
+                tovisit.append(w)
+    return dist
+
+
+@pytest.fixture(scope="module")
+def graph(bicube_fuse):
+    indptr, indices, _ = analytics.state_graph(bicube_fuse, e.TURNABLE)
+    dists = [naive_distances(indptr, indices, v)
+             for v in range(len(indptr) - 1)]
+    return indptr, indices, dists
+
+
+def test_exact(graph):
+    indptr, indices, dists = graph
+    stats = analytics.distance_stats(indptr, indices)
+    assert stats["exact"]
+    assert stats["eccentricities"].tolist() == [d.max() for d in dists]
+    assert stats["histogram"].tolist() == np.bincount(
+        np.concatenate(dists)).tolist()
+    assert stats["solved_histogram"].tolist() == np.bincount(dists[0]).tolist()
+    assert stats["diameter"] == 12
+
+
+def test_sampled(graph):
+    indptr, indices, dists = graph
+    sources = analytics.sample_sources(len(dists), 70)
+    stats = analytics.distance_stats(indptr, indices, sources)
+    assert not stats["exact"]
+    assert stats["eccentricities"].tolist() == [dists[v].max()
+                                                for v in np.sort(sources)]
@@ -0,0 +1,63 @@
+""" Regression checks of checkpointing: a split interrupted at any of its
+checkpoints and resumed gives the same result set as an uninterrupted one. """
+import numpy as np
+import pytest
+import enumerator as e
+from checkpoint import Checkpoint
+
+TREE = [  1, 2, 3,
+         4, 5, 6,
+        7, 8, 9,
+          10, 11, 12,
+         10, 11, 12,
+        10, 11, 12,
+          13, 14, 15,
+         13, 14, 15,
+        13, 14, 15]
+
+
+class Interrupted(Exception):
+    pass
+
+
+class CrashingCheckpoint(Checkpoint):
+    """ Saves on every due call and raises after the given number of saves. """
+
+    def __init__(self, path, crash_after):
+        super().__init__(path, e.MAPPING_HASH, interval=0)
+        self.crash_after = crash_after
+
+    def due(self, every=1):
+        return super().due(1)
+
+    def save(self, **state):
+        super().save(**state)
+        self.crash_after -= 1
+        if self.crash_after == 0:
+            raise Interrupted
+
+
+def run_split(res, checkpoint=None, stack=None):
+    maxid = max(TREE)
+    blocks_to_split = sorted([(TREE.count(i), i) for i in range(1, maxid + 1)])
+    e.split(np.array(TREE, dtype=np.uint8), res, blocks_to_split, maxid,
+            checkpoint=checkpoint, stack=stack)
+    return res
+
+
+@pytest.mark.parametrize("crash_after", [1, 10, 500])
+def test_split_resume(tmp_path, crash_after):
+    full = run_split(set())
+    path = str(tmp_path / "split.npz")
+    with pytest.raises(Interrupted):
+        run_split(set(), CrashingCheckpoint(path, crash_after))
+    state = Checkpoint(path, e.MAPPING_HASH, resume=True).load()
+    res = run_split(set(state["res"]), stack=e.unpack_split_stack(state))
+    assert res == full
+
+
+def test_stale_checkpoint_rejected(tmp_path):
+    path = str(tmp_path / "split.npz")
+    Checkpoint(path, e.MAPPING_HASH ^ 1).save(res=np.zeros(1, dtype=np.uint64))
+    with pytest.raises(ValueError):
+        Checkpoint(path, e.MAPPING_HASH, resume=True).load()
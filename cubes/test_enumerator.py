@@ -0,0 +1,45 @@
+""" Regression checks of symmetry-reduced exploration: full state count and
+symmetry group found by explore_quotient agree with exploring all states and
+with trying every symmetry on them, also for cubes with the bits unused by
+the mapping set, as produced by splitting. """
+import numpy as np
+import pytest
+import enumerator as e
+
+UNUSED = np.invert(e.USED_SLOTS)
+# top layer cut into single cubies, the other two into bars and 2x1 blocks
+TREE = list(range(1, 10)) + [10, 11, 12, 10, 11, 12, 13, 14, 15] + [16, 17, 18] * 3
+
+
+def split_sample(step=16):
+    maxid = max(TREE)
+    blocks_to_split = sorted([(TREE.count(i), i) for i in range(1, maxid + 1)])
+    res = set()
+    e.split(np.array(TREE, dtype=np.uint8), res, blocks_to_split, maxid)
+    return sorted(res)[::step]
+
+
+def brute_group(states):
+    """ Symmetries mapping the set of states onto itself. """
+    states = np.array(sorted(states), dtype=np.uint64)
+    images = np.sort(e.symmetry_images(states), axis=0)
+    return [e.SYMMETRIES[i] for i in range(len(e.SYMMETRIES))
+            if (images[:, i] == states).all()]
+
+
+@pytest.mark.parametrize("cube", [np.uint64(0), UNUSED] + split_sample())
+def test_quotient_matches_explore(cube):
+    verts = e.explore(cube, e.TURNABLE)[0]
+    res = e.explore(cube, e.TURNABLE, reduce_symmetry=True)
+    group, full = res[5], res[6]
+    assert full == len(verts)
+    assert sorted(group) == sorted(brute_group(verts))
+    assert verts == set(e.explore(cube & e.USED_SLOTS, e.TURNABLE)[0])
+
+
+def test_quotient_bicube(bicube_fuse):
+    for cube in [bicube_fuse, bicube_fuse | UNUSED]:
+        verts = e.explore(cube, e.TURNABLE)[0]
+        group, full = e.explore(cube, e.TURNABLE, reduce_symmetry=True)[5:]
+        assert full == len(verts) == 121
+        assert sorted(group) == sorted(brute_group(verts))
@@ -0,0 +1,106 @@
+""" Regression checks of the pipeline: stages run on a truncated split tree
+give the same cubes as computing each stage cube by cube, whether chunks are
+mapped in process or in worker processes, and a run crashing in the middle
+of a stage resumes from the chunks already finished. Profiles of a run
+cover the stage functions. """
+import os
+import pstats
+import numpy as np
+import pytest
+import enumerator as e
+import pipeline
+from metrics import CounterMetrics
+
+# top layer cut into single cubies, the other two into bars and 2x1 blocks
+TREE = [  1, 2, 3,
+         4, 5, 6,
+        7, 8, 9,
+          10, 11, 12,
+         10, 11, 12,
+        13, 14, 15,
+          16, 17, 18,
+         16, 17, 18,
+        16, 17, 18]
+CHUNK_SIZE = 32
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(scope="module")
+def phase0():
+    maxid = max(TREE)
+    blocks_to_split = sorted([(TREE.count(i), i) for i in range(1, maxid + 1)])
+    res = set()
+    e.split(np.array(TREE, dtype=np.uint8), res, blocks_to_split, maxid)
+    return np.sort(np.fromiter(res, dtype=np.uint64, count=len(res)))
+
+
+@pytest.fixture(scope="module")
+def expected(phase0):
+    """ Stage outputs computed cube by cube, without chunks and reuse. """
+    ibonds = []
+    for cube in phase0:
+        state = cube & e.USED_SLOTS
+        closed = e.implicit_bonds(state, e.TURNABLE)[int(state)]
+        ibonds.append(cube | np.uint64(closed))
+    norot = {e.canonical_rotation(cube) for cube in ibonds}
+    classes = {min(e.canonical_rotation(v) for v in
+                   e.explore_fast(cube & e.USED_SLOTS, e.TURNABLE, set()))
+               for cube in norot}
+    return {"phase0": phase0.tolist(), "ibonds": sorted(set(ibonds)),
+            "norot": sorted(norot), "classes": sorted(classes)}
+
+
+def write_phase0(root, phase0):
+    stagedir = os.path.join(root, "phase0")
+    os.makedirs(stagedir)
+    pipeline.write_index(stagedir, pipeline.write_shards([phase0], stagedir,
+                                                         CHUNK_SIZE))
+
+
+def stage_cubes(root, stage):
+    paths = pipeline.shard_paths(os.path.join(root, stage))
+    return np.concatenate([e.load_shard(p) for p in paths]).tolist()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_stages(tmp_path, phase0, expected, workers):
+    root = str(tmp_path)
+    write_phase0(root, phase0)
+    pipeline.run_pipeline(root, CHUNK_SIZE, stages=pipeline.STAGES[1:],
+                          workers=workers)
+    for stage in pipeline.STAGES:
+        assert stage_cubes(root, stage) == expected[stage]
+
+
+def test_resume_mid_stage(tmp_path, monkeypatch, phase0, expected):
+    root = str(tmp_path)
+    write_phase0(root, phase0)
+    pipeline.run_pipeline(root, CHUNK_SIZE, stages=["ibonds", "norot"])
+    calls = []
+
+    def crashing(chunk, metrics):
+        calls.append(len(chunk))
+        if len(calls) == 3:
+            raise Interrupted
+        return pipeline.class_keys(chunk, metrics)
+    monkeypatch.setitem(pipeline.STAGE_FUNCS, "classes", crashing)
+    with pytest.raises(Interrupted):
+        pipeline.run_pipeline(root, CHUNK_SIZE, stages=["classes"])
+    monkeypatch.undo()
+    metrics = CounterMetrics()
+    pipeline.run_pipeline(root, CHUNK_SIZE, stages=["classes"],
+                          metrics=metrics, resume=True)
+    assert metrics.counters["chunks_resumed"] == 2
+    assert stage_cubes(root, "classes") == expected["classes"]
+
+
+def test_profile_sees_stage_functions(tmp_path, phase0):
+    root, stats = str(tmp_path / "out"), str(tmp_path / "stats")
+    write_phase0(root, phase0)
+    pipeline.main([root, "--chunk-size", str(CHUNK_SIZE), "--stages", "ibonds",
+                   "--profile", stats, "--workers", "2"])
+    funcs = {name for _, _, name in pstats.Stats(stats).stats}
+    assert "implicit_bonds" in funcs
@@ -0,0 +1,107 @@
+""" Regression checks of remap: a pipeline catalogue converted to another
+mapping and back, or stored under another mapping and converted to the current
+one, equals the original, including canonical representatives of norot and
+checkpoints of unfinished stages. """
+import json
+import os
+import numpy as np
+import pytest
+import enumerator as e
+import pipeline
+import remap
+from checkpoint import Checkpoint
+
+CHUNK_SIZE = 50
+
+
+def shuffled_mapping(seed=0):
+    pairs = sorted(e.MAPPING)
+    offsets = [e.MAPPING[p] for p in pairs]
+    np.random.default_rng(seed).shuffle(offsets)
+    return dict(zip(pairs, offsets))
+
+
+def stage_cubes(root, stage, mhash=e.MAPPING_HASH):
+    stagedir = os.path.join(root, stage)
+    with open(os.path.join(stagedir, pipeline.INDEX)) as f:
+        files = [s["file"] for s in json.load(f)["shards"]]
+    return np.concatenate([e.load_shard(os.path.join(stagedir, f), mhash=mhash)
+                           for f in files]).tolist()
+
+
+@pytest.fixture(scope="module")
+def catalogue(tmp_path_factory, bicube_fuse):
+    """ Stages phase0 to norot with all states of a small puzzle as phase0. """
+    root = str(tmp_path_factory.mktemp("catalogue"))
+    stagedir = os.path.join(root, "phase0")
+    os.makedirs(stagedir)
+    states = e.explore_fast(bicube_fuse, e.TURNABLE, set())
+    cubes = np.sort(np.fromiter(states, dtype=np.uint64))
+    pipeline.write_index(stagedir, pipeline.write_shards([cubes], stagedir,
+                                                         CHUNK_SIZE))
+    pipeline.run_pipeline(root, CHUNK_SIZE, stages=["ibonds", "norot"])
+    return root
+
+
+def copy_as(root, dst, old, new):
+    """ Copy stages of root stored under old mapping as if they were computed
+    under new mapping: bits are moved and norot holds the smallest rotation
+    under new mapping. """
+    func = remap.remap_func(old, new)
+    for stage in ["phase0", "ibonds", "norot"]:
+        stagedir = os.path.join(dst, stage)
+        os.makedirs(stagedir)
+        cubes = np.array(stage_cubes(root, stage), dtype=np.uint64)
+        if stage == "norot":
+            rotations = [e.symmetry_images(c)[:len(e.ROTATIONS)] for c in cubes]
+            cubes = np.unique([func(r).min() for r in rotations])
+        else:
+            cubes = np.sort(func(cubes))
+        e.save_shard(os.path.join(stagedir, "shard_00000.bin"), cubes,
+                     remap.mapping_hash(new))
+        with open(os.path.join(stagedir, pipeline.INDEX), "w") as f:
+            json.dump({"mapping": remap.mapping_hash(new),
+                       "shards": [{"file": "shard_00000.bin",
+                                   "count": len(cubes)}],
+                       "total": len(cubes)}, f)
+
+
+def test_round_trip(catalogue, tmp_path):
+    shuffled = shuffled_mapping()
+    root = str(tmp_path)
+    copy_as(catalogue, root, e.MAPPING, e.MAPPING)
+    remap.remap_catalogue(root, e.MAPPING, shuffled, CHUNK_SIZE)
+    with pytest.raises(ValueError):
+        pipeline.shard_paths(os.path.join(root, "phase0"))
+    assert not os.path.exists(os.path.join(root, "norot"))  # to be rerun
+    assert remap.remap_catalogue(root, e.MAPPING, shuffled, CHUNK_SIZE) == 0
+    remap.remap_catalogue(root, shuffled, e.MAPPING, CHUNK_SIZE)
+    for stage in ["phase0", "ibonds"]:
+        assert stage_cubes(root, stage) == stage_cubes(catalogue, stage)
+
+
+def test_canonicalize(catalogue, tmp_path):
+    shuffled = shuffled_mapping()
+    root = str(tmp_path)
+    copy_as(catalogue, root, e.MAPPING, shuffled)
+    os.makedirs(os.path.join(root, "classes", "runs_%d" % CHUNK_SIZE))
+    remap.remap_catalogue(root, shuffled, e.MAPPING, CHUNK_SIZE)
+    for stage in ["phase0", "ibonds", "norot"]:
+        assert stage_cubes(root, stage) == stage_cubes(catalogue, stage)
+    assert os.listdir(os.path.join(root, "classes")) == []
+
+
+def test_checkpoint_round_trip(catalogue, tmp_path):
+    shuffled = shuffled_mapping()
+    stagedir = tmp_path / "phase0"
+    stagedir.mkdir()
+    path = str(stagedir / "split.npz")
+    res = np.array(stage_cubes(catalogue, "phase0"), dtype=np.uint64)
+    Checkpoint(path, e.MAPPING_HASH).save(res=res, branch=1)
+    remap.remap_catalogue(str(tmp_path), e.MAPPING, shuffled)
+    with pytest.raises(ValueError):
+        Checkpoint(path, e.MAPPING_HASH, resume=True).load()
+    remap.remap_catalogue(str(tmp_path), shuffled, e.MAPPING)
+    state = Checkpoint(path, e.MAPPING_HASH, resume=True).load()
+    assert state["res"].tolist() == res.tolist()
+    assert state["branch"] == 1